@@ -1,9 +1,11 @@
 import uuid
-from math import sqrt
-from tetris.tetris_ai import Parameters, TetrisAI
+from math import sqrt, log
+from tetris.tetris_ai import Parameters
 from random import uniform
-from typing import NamedTuple
-import pickle
+from tetris import vectorized
+from tetris.piece_stream import PieceStream
+from typing import NamedTuple, List, Tuple
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,7 +20,35 @@ class Fitness(NamedTuple):
     clean_lines: int
 
 
+class Racing(NamedTuple):
+    """
+    stop playing games when candidate can not beat threshold fitness,
+    confidence - stop also when Hoeffding bound shows with this
+    probability that win rate of candidate is lower than threshold's
+    """
+    threshold: Fitness
+    confidence: float = None
+
+    def is_settled(self, won: int, played: int, games_number: int) -> bool:
+        """test if remaining games can not change outcome"""
+        target = self.threshold.won_games
+        if won + games_number - played < target:
+            return True
+        if self.confidence is None:
+            return False
+
+        bound = sqrt(log(1 / (1 - self.confidence)) / (2 * played))
+        return won / played + bound < target / games_number
+
+
+# games played between tests if racing candidate is already settled
+RACING_GAMES = 10
+
+
 class Candidate:
+    __slots__ = ('parameters', 'fitness', 'id', 'auto_save', 'games_played',
+                 'eliminated')
+
     @staticmethod
     def normalize(parameters: Parameters) -> Parameters:
         """normalize vector of parameters -> total length of vector is |1|"""
@@ -32,24 +62,72 @@ class Candidate:
                                      uniform(-1, 0), uniform(-1, 0))
         self.parameters = Candidate.normalize(p)
         self.fitness = fitness
-        self.id = uuid.uuid4()
+        self.id: int = uuid.uuid4().int
         self.auto_save = auto_save
-
-    def fit(self, games_number, tetrominos_in_single_game):
-        """calculate fitness value"""
-        ai = TetrisAI(self.parameters)
-        won, total_clean_lines = 0, 0
-        for i in range(games_number):
-            is_win, clean_lines = ai.play_game(tetrominos_in_single_game)
-            if is_win:
-                won += 1
-            total_clean_lines += clean_lines
-
-        self.fitness = Fitness(won, total_clean_lines)
-        if self.auto_save:
-            self.save()
+        self.games_played: int = None
+        # racing stopped games, fitness is not comparable with others
+        self.eliminated = False
+
+    def fit(self, games_number, tetrominos_in_single_game,
+            stream: PieceStream = None, racing: Racing = None):
+        """
+        calculate fitness value,
+        stream - seeded games, random games are played when not given,
+        racing - games are stopped when outcome is settled,
+        then candidate is eliminated
+        """
+        pieces = get_pieces(games_number, tetrominos_in_single_game, stream)
+        return self.set_fitness(*play(self.parameters, pieces, racing),
+                                games_number)
+
+    def set_fitness(self, won_games: int, clean_lines: int,
+                    games_played: int, games_number: int):
+        """
+        store fitness calculated from games_played games, candidate
+        which played less than games_number games is eliminated
+        """
+        self.fitness = Fitness(int(won_games), int(clean_lines))
+        self.games_played = int(games_played)
+        self.eliminated = self.games_played < games_number
         return self
 
+    @staticmethod
+    def fit_all(candidates: List["Candidate"], games_number,
+                tetrominos_in_single_game, stream: PieceStream = None,
+                racing: Racing = None) -> List["Candidate"]:
+        """
+        calculate fitness value of all candidates in one simulation,
+        every candidate plays the same games
+        """
+        pieces = get_pieces(games_number, tetrominos_in_single_game, stream)
+        step = RACING_GAMES if racing else games_number
+        won = np.zeros(len(candidates), dtype=int)
+        clean_lines = np.zeros(len(candidates), dtype=int)
+        played = np.zeros(len(candidates), dtype=int)
+        racing_id = np.arange(len(candidates))
+
+        for start in range(0, games_number, step):
+            games = pieces[start:start + step]
+            parameters = np.array([candidates[i].parameters
+                                   for i in racing_id])
+            w, lines = vectorized.play_population(parameters, games)
+            won[racing_id] += w
+            clean_lines[racing_id] += lines
+            played[racing_id] += len(games)
+
+            if racing:
+                racing_id = np.array([
+                    i for i in racing_id
+                    if not racing.is_settled(won[i], played[i], games_number)
+                ], dtype=int)
+                if len(racing_id) == 0:
+                    break
+
+        for i, candidate in enumerate(candidates):
+            candidate.set_fitness(won[i], clean_lines[i], played[i],
+                                  games_number)
+        return candidates
+
     def __lt__(self, other):
         if not isinstance(other, Candidate):
             raise TypeError
@@ -87,11 +165,44 @@ class Candidate:
         ret += str(self.parameters)
         return ret
 
-    def get_name(self):
-        return str(self.id) + suffix
+    def __setstate__(self, state):
+        """accept also candidates pickled before __slots__ were used"""
+        self.games_played = None
+        self.eliminated = False
+        if isinstance(state, tuple):
+            _dict_state, state = state
+        for name, value in state.items():
+            setattr(self, name, value)
+        if isinstance(self.id, uuid.UUID):
+            self.id = self.id.int
 
-    def save(self):
-        name = directory + self.get_name()
-        with open(name, "wb") as file:
-            pickle.dump(self, file, pickle.DEFAULT_PROTOCOL)
-            logger.debug("saved candidate: {}".format(name))
+    def get_name(self):
+        return str(uuid.UUID(int=self.id)) + suffix
+
+
+def get_pieces(games_number, tetrominos_in_single_game,
+               stream: PieceStream = None) -> np.ndarray:
+    """return pieces of stream or random pieces when stream is not given"""
+    if stream:
+        return stream.pieces(games_number, tetrominos_in_single_game)
+    return vectorized.random_pieces(games_number, tetrominos_in_single_game)
+
+
+def play(parameters: Parameters, pieces: np.ndarray,
+         racing: Racing = None) -> Tuple[int, int, int]:
+    """
+    play games of pieces, with racing in steps of RACING_GAMES until
+    outcome is settled, return won games, clean lines and played games
+    """
+    games_number = len(pieces)
+    step = RACING_GAMES if racing else max(games_number, 1)
+
+    won, clean_lines, played = 0, 0, 0
+    while played < games_number:
+        w, lines = vectorized.play_games(pieces[played:played + step],
+                                         parameters)
+        won, clean_lines = won + int(w.sum()), clean_lines + int(lines.sum())
+        played += len(w)
+        if racing and racing.is_settled(won, played, games_number):
+            break
+    return won, clean_lines, played
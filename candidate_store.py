@@ -0,0 +1,145 @@
+from candidate import Candidate, Fitness
+from tetris.tetris_ai import Parameters
+from typing import List, Iterable
+import numpy as np
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# file of store in directory of candidates
+STORE_FILE = "population.store"
+
+# saved candidate, removed candidate has alive False
+RECORD = np.dtype([('id', 'V16'), ('parameters', '<f8', (4,)),
+                   ('won_games', '<i8'), ('clean_lines', '<i8'),
+                   ('generation', '<i8'), ('alive', '?')])
+
+# store is compacted when it has this times more records than candidates
+COMPACT_FACTOR = 4
+# suffix of snapshot of generation
+SNAPSHOT = ".{:06d}.npy"
+
+
+class CandidateStore:
+    """
+    append-only file of fixed size records of saved and removed
+    candidates, changes are written together by flush, file is read by
+    one sequential read and rewritten only with living candidates when
+    most of its records are outdated,
+    snapshot writes living candidates to .npy file of generation and
+    empties the file, then store is read from memory mapped snapshot
+    and changes made after it, snapshots of all generations are kept
+    and they can be read by np.load without this project
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.records = 0
+        # record of every living candidate by id
+        self.living = {}
+        # last generation of records or snapshots
+        self.generation = 0
+        self._pending = []
+        snapshots = self.snapshots()
+        if snapshots:
+            self._read_snapshot(snapshots[-1])
+        if os.path.exists(filename):
+            self._read()
+
+    def _snapshot_name(self, generation: int) -> str:
+        return os.path.splitext(self.filename)[0] + SNAPSHOT.format(generation)
+
+    def snapshots(self) -> List[str]:
+        """return files of snapshots sorted by generation"""
+        directory, name = os.path.split(self.filename)
+        prefix = os.path.splitext(name)[0] + "."
+        names = [n for n in os.listdir(directory or ".")
+                 if n.startswith(prefix) and n.endswith(".npy")]
+        return [os.path.join(directory, n) for n in sorted(names)]
+
+    def _read_snapshot(self, filename: str):
+        records = np.load(filename, mmap_mode='r')
+        self._apply(records.tolist())
+        generation = filename[-len(SNAPSHOT.format(0)):].split(".")[1]
+        self.generation = max(self.generation, int(generation))
+        logger.debug("read snapshot {} of {} candidates"
+                     .format(filename, len(self.living)))
+
+    def _read(self):
+        with open(self.filename, "rb") as file:
+            data = file.read()
+        # last record can be incomplete when writing was interrupted
+        self.records = len(data) // RECORD.itemsize
+        records = np.frombuffer(data, RECORD, self.records)
+        self._apply(records.tolist())
+        logger.debug("read {} records of {} candidates"
+                     .format(self.records, len(self.living)))
+
+    def _apply(self, records: Iterable[tuple]):
+        for record in records:
+            key, alive = bytes(record[0]), record[-1]
+            self.generation = max(self.generation, record[-2])
+            if alive:
+                self.living[key] = record
+            else:
+                self.living.pop(key, None)
+
+    def add(self, candidates: Iterable[Candidate], generation: int):
+        for c in candidates:
+            self._pending.append((c.id.to_bytes(16, 'little'), c.parameters,
+                                  *c.fitness, generation, True))
+
+    def remove(self, candidates: Iterable[Candidate], generation: int):
+        for c in candidates:
+            self._pending.append((c.id.to_bytes(16, 'little'), (0,) * 4,
+                                  0, 0, generation, False))
+
+    def flush(self):
+        """append added and removed candidates to file"""
+        if not self._pending:
+            return
+        with open(self.filename, "ab") as file:
+            file.write(np.array(self._pending, RECORD).tobytes())
+        self._apply(self._pending)
+        self.records += len(self._pending)
+        self._pending = []
+
+        if self.records > COMPACT_FACTOR * max(len(self.living), 1):
+            self.compact()
+
+    def compact(self):
+        """rewrite file with living candidates only"""
+        temporary = self.filename + ".tmp"
+        with open(temporary, "wb") as file:
+            file.write(np.array(list(self.living.values()), RECORD).tobytes())
+        os.replace(temporary, self.filename)
+        logger.debug("compacted {} records to {}"
+                     .format(self.records, len(self.living)))
+        self.records = len(self.living)
+
+    def snapshot(self, generation: int):
+        """write living candidates to snapshot of generation"""
+        self.flush()
+        temporary = self.filename + ".tmp"
+        with open(temporary, "wb") as file:
+            np.save(file, np.array(list(self.living.values()), RECORD))
+        os.replace(temporary, self._snapshot_name(generation))
+        self.generation = max(self.generation, generation)
+        # changes in file are already in snapshot, so repeating them
+        # after crash before truncation does not change candidates
+        open(self.filename, "wb").close()
+        self.records = 0
+
+    def load(self) -> List[Candidate]:
+        """return living candidates in order of saving"""
+        candidates = []
+        for key, parameters, won, lines, _generation, _alive \
+                in self.living.values():
+            candidate = Candidate(Parameters(*parameters), Fitness(won, lines),
+                                  auto_save=True)
+            # saved parameters are already normalized
+            candidate.parameters = Parameters(*map(float, parameters))
+            candidate.id = int.from_bytes(key, 'little')
+            candidates.append(candidate)
+        return candidates
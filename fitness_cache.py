@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import Tuple, Optional
+from candidate import Fitness
+from tetris.tetris_ai import Parameters
+from tetris.piece_stream import PieceStream
+import pickle
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# parameters closer than this are the same, normalized parameters of
+# the same candidate differ only by rounding errors
+QUANTUM = 1e-9
+
+# quantized parameters, number of games, tetrominos in game, seed and
+# bag of piece stream
+Key = Tuple[Tuple[int, ...], int, int, Tuple[int, ...], bool]
+
+
+def fitness_key(parameters: Parameters, games_number: int,
+                tetrominos_in_single_game: int, stream: PieceStream) -> Key:
+    """return key of games played by parameters"""
+    quantized = tuple(round(x / QUANTUM) for x in parameters)
+    return (quantized, games_number, tetrominos_in_single_game,
+            tuple(stream.seed), stream.bag)
+
+
+class FitnessCache:
+    """
+    fitness of parameters played on seeded games, the least recently
+    used fitness is removed when cache is full,
+    filename - cache is loaded from file and saved by save
+    """
+
+    def __init__(self, size: int, filename: str = None):
+        self.size = size
+        self.filename = filename
+        self.fitness: OrderedDict = OrderedDict()
+        self.hits = self.misses = 0
+        self._changed = False
+
+        if filename and os.path.exists(filename):
+            with open(filename, "rb") as file:
+                self.fitness.update(pickle.load(file))
+            logger.debug("loaded {} fitness from {}"
+                         .format(len(self.fitness), filename))
+            self._evict()
+
+    def get(self, key: Key) -> Optional[Fitness]:
+        fitness = self.fitness.get(key)
+        if fitness is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.fitness.move_to_end(key)
+        return fitness
+
+    def put(self, key: Key, fitness: Fitness):
+        self.fitness[key] = fitness
+        self.fitness.move_to_end(key)
+        self._changed = True
+        self._evict()
+
+    def _evict(self):
+        while len(self.fitness) > self.size:
+            self.fitness.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        asked = self.hits + self.misses
+        return self.hits / asked if asked else 0.0
+
+    def save(self):
+        """write cache to its file when it was changed"""
+        if not self.filename or not self._changed:
+            return
+        temporary = self.filename + ".tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump(self.fitness, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.filename)
+        self._changed = False
+
+    def __len__(self):
+        return len(self.fitness)
+
@@ -1,17 +1,38 @@
 from tetris.tetris_ai import Parameters
-from random import random, randrange, uniform
-from typing import List, Tuple
-from multiprocess_map import parallel_map_fun
+from random import random, randrange, uniform, getrandbits
+from typing import List, Tuple, Optional
+from multiprocess_map import worker_pool, fit_candidates, pack_job
 from python_socket_client_server.server import Server
 import pickle
 import logging
 import os
-from candidate import Candidate, directory
+import itertools
+from candidate import Candidate, Racing, directory, suffix
+from candidate_store import CandidateStore, STORE_FILE
+from tetris.piece_stream import PieceStream
+from fitness_cache import FitnessCache, fitness_key
+from population import population_arrays, normalize, fitness_order, \
+    tournament, crossover, mutate
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 old_filename = "old.genetic"
 
+# settings compared with saved algorithm, default is used when saved
+# algorithm does not have setting
+CONFIG_DEFAULTS = {
+    "num_of_population": None,
+    "games_number": None,
+    "tetrominos_in_single_game": None,
+    "parents_num_in_tournament": None,
+    "offsprings_num": None,
+    "mutation_chance": None,
+    "mutation_max_value": None,
+    "seed": None,
+    "bag": False,
+}
+
 DEFAULT_HOST, DEFAULT_PORT = 'localhost', 45054
 
 
@@ -19,7 +40,8 @@ class GeneticAlgorithm:
     fit_types = {
         "single": 0,
         "multi": 1,
-        "socket": 2
+        "socket": 2,
+        "batch": 3
     }
 
     REQUIRED_DIR = [
@@ -33,13 +55,13 @@ class GeneticAlgorithm:
         "tetris/__init__.py",
         "tetris/tetris_ai.py",
         "tetris/board.py",
+        "tetris/bit_board.py",
         "tetris/tetromino.py",
+        "tetris/placement.py",
+        "tetris/vectorized.py",
+        "tetris/piece_stream.py",
     ]
 
-    @staticmethod
-    def receive_function(c: Candidate):
-        c.save()
-
     def __init__(self,
                  num_of_population: int,
                  games_number: int = 100,
@@ -49,7 +71,39 @@ class GeneticAlgorithm:
                  mutation_chance: float = 0.05,
                  mutation_max_value: float = 0.2,
                  load_files: bool = True,
-                 fit_type: str = "multi"):
+                 fit_type: str = "multi",
+                 seed: int = None,
+                 bag: bool = False,
+                 racing: bool = False,
+                 racing_confidence: float = None,
+                 shared_memory: bool = False,
+                 cache_size: int = 0,
+                 cache_file: str = None,
+                 snapshots: bool = False,
+                 numpy_operators: bool = False,
+                 steady_state: bool = False):
+        """
+        seed - seed of games played by every candidate of whole run,
+        so survivors and offspring are compared on the same games,
+        without seed every generation plays new random games,
+        bag - every 7 tetrominos are permutation of all shapes,
+        racing - offspring stop playing when they can not survive
+        next selection, see Racing for racing_confidence,
+        shared_memory - multi fit passes parameters, pieces and results
+        to workers by shared memory,
+        cache_size - number of fitness remembered for seeded games, so
+        the same parameters are not fitted again, see FitnessCache,
+        cache_file - file where cache is kept between runs,
+        snapshots - saved population of every generation is kept in .npy
+        file, see CandidateStore,
+        numpy_operators - selection, crossover and mutation are done
+        over arrays of whole population with generator seeded by seed,
+        see population module,
+        steady_state - offsprings_num offspring are fitted at once, every
+        fitted offspring replaces the worst candidate and new offspring
+        is sent immediately, so workers do not wait for whole generation,
+        it needs multi or socket fit_type without shared_memory
+        """
 
         assert num_of_population >= parents_num_in_tournament
         assert num_of_population >= offsprings_num
@@ -64,15 +118,37 @@ class GeneticAlgorithm:
         self.mutation_chance = mutation_chance
         self.mutation_max_value = mutation_max_value
         self.load_files = load_files
+        self.seed = seed
+        self.bag = bag
+        self.racing = racing
+        self.racing_confidence = racing_confidence
+        self.shared_memory = shared_memory
+        self.generation = 0
+        self.pool = None
+        self.cache = None
+        if cache_size and seed is not None:
+            self.cache = FitnessCache(cache_size, cache_file)
+        self.store = None
+        self.snapshots = snapshots
+        self.numpy_operators = numpy_operators
+        self.steady_state = steady_state
+        self.rng = np.random.default_rng(seed)
 
         if load_files:
             self._compare_last_algorithm()
+            os.makedirs(directory, exist_ok=True)
+            self.store = CandidateStore(directory + STORE_FILE)
 
         if fit_type not in GeneticAlgorithm.fit_types:
             raise ValueError("wrong fit_type")
         else:
             self.fit_type: int = GeneticAlgorithm.fit_types[fit_type]
 
+        if steady_state and (fit_type not in ("multi", "socket")
+                             or shared_memory):
+            raise ValueError("steady state needs multi or socket fit_type "
+                             "without shared memory")
+
         if fit_type == "socket":
             self._start_socket()
 
@@ -86,16 +162,27 @@ class GeneticAlgorithm:
         with open(old_filename, "wb") as new_file:
             pickle.dump(self, new_file)
 
+    def _config(self) -> dict:
+        """
+        return settings which saved candidates depend on, settings
+        missing in algorithms saved by older versions get defaults
+        """
+        return {name: getattr(self, name, default)
+                for name, default in CONFIG_DEFAULTS.items()}
+
+    def __getstate__(self):
+        return self._config()
+
     def __eq__(self, other):
         if not isinstance(other, GeneticAlgorithm):
             return False
-        return self.__dict__ == other.__dict__
+        return self._config() == other._config()
 
     def _generate_population(self):
         """create random population or load from files"""
 
         self.population: List[Candidate] = []
-        if self._is_saved():
+        if self.store is not None:
             self._load_from_files()
 
         new_population = []
@@ -103,56 +190,143 @@ class GeneticAlgorithm:
             new_population.append(Candidate(auto_save=self.load_files))
 
         self.population.extend(self._fit_all(new_population))
-
-    def _is_saved(self):
-        if not os.path.exists(directory):
-            os.mkdir(directory)
-        return self.load_files and os.listdir(directory)
+        if self.store is not None:
+            self.store.add(new_population, self.generation)
+            self._save_store()
 
     def _load_from_files(self):
-        for filename in os.listdir(directory):
-            assert filename.endswith(".candidate")
+        """
+        load candidates from store, candidates saved by older versions
+        in own files are moved to store
+        """
+        filenames = [filename for filename in os.listdir(directory)
+                     if filename.endswith(suffix)]
+        for filename in filenames:
             with open(directory + filename, "rb") as file:
                 candidate: Candidate = pickle.load(file)
                 logger.debug("load candidate: {}".format(filename))
-                self.population.append(candidate)
-            if len(self.population) == self.num_of_population:
-                break
-
-    def _fit_all(self, candidates: List[Candidate]) -> List[Candidate]:
-        """calculate fitness value for candidates"""
-
+                self.store.add([candidate], self.generation)
+        self.store.flush()
+        for filename in filenames:
+            os.remove(directory + filename)
+
+        self.population = self.store.load()[:self.num_of_population]
+        # snapshots of resumed run follow snapshots of stopped one
+        self.generation = self.store.generation
+        logger.debug("loaded {} candidates".format(len(self.population)))
+
+    def _save_store(self):
+        """write changes of generation to store"""
+        if self.snapshots:
+            self.store.snapshot(self.generation)
+        else:
+            self.store.flush()
+
+    def _piece_stream(self) -> PieceStream:
+        """return games played by all candidates of current generation"""
+        if self.seed is not None:
+            return PieceStream((self.seed,), self.bag)
+        return PieceStream((getrandbits(32), self.generation), self.bag)
+
+    def _racing(self) -> Optional[Racing]:
+        """
+        return fitness of the worst candidate which survives next
+        selection, offspring worse than it will be removed in next
+        generation, so their games can be stopped
+        """
+        survivors = self.num_of_population - self.offsprings_num
+        if not self.racing or not self.population or survivors <= 0:
+            return None
+
+        worst_survivor = sorted(self.population, reverse=True)[survivors - 1]
+        return Racing(worst_survivor.fitness, self.racing_confidence)
+
+    def _fit_all(self, candidates: List[Candidate],
+                 racing: Racing = None) -> List[Candidate]:
+        """
+        calculate fitness value for candidates, candidates with the same
+        parameters are fitted once, fitness of known parameters is taken
+        from cache
+        """
+        stream = self._piece_stream()
+        g, t = self.games_number, self.tetrominos_in_single_game
+
+        to_fit, cached = {}, 0
+        for candidate in candidates:
+            key = fitness_key(candidate.parameters, g, t, stream)
+            fitness = self.cache.get(key) if self.cache is not None else None
+            if fitness is not None:
+                candidate.set_fitness(*fitness, g, g)
+                cached += 1
+            else:
+                to_fit.setdefault(key, []).append(candidate)
+
+        if to_fit:
+            self._fit([same[0] for same in to_fit.values()], stream, racing)
+        for first, *same in to_fit.values():
+            for candidate in same:
+                candidate.set_fitness(*first.fitness, first.games_played, g)
+
+        if self.cache is not None:
+            for key, (first, *_same) in to_fit.items():
+                if not first.eliminated:
+                    self.cache.put(key, first.fitness)
+            self.cache.save()
+            logger.info("{} fitness from cache: {}/{}, hit rate: {:.1%}"
+                        .format(self.generation, cached, len(candidates),
+                                self.cache.hit_rate()))
+        return candidates
+
+    def _fit(self, candidates: List[Candidate], stream: PieceStream,
+             racing: Racing = None) -> List[Candidate]:
+        """calculate fitness value for candidates playing games of stream"""
         #  one computer one thread
         if self.fit_type == GeneticAlgorithm.fit_types["single"]:
             ret = []
             for i, candidate in enumerate(candidates):
                 ret.append(candidate.fit(self.games_number,
-                                         self.tetrominos_in_single_game))
+                                         self.tetrominos_in_single_game,
+                                         stream, racing))
                 logger.debug("iteration: {}, status: {}".format(i, candidate))
             return ret
 
         # one computer many threads
         elif self.fit_type == GeneticAlgorithm.fit_types["multi"]:
-            g, t = self.games_number, self.tetrominos_in_single_game
-            candidates = list(map(lambda x: (x, g, t), candidates))
-            return parallel_map_fun(candidates)
+            if self.pool is None:
+                self.pool = worker_pool(self.shared_memory)
+            return fit_candidates(self.pool, candidates, self.games_number,
+                                  self.tetrominos_in_single_game, stream,
+                                  racing, self.shared_memory)
+
+        # one computer, all candidates simulated together
+        elif self.fit_type == GeneticAlgorithm.fit_types["batch"]:
+            return Candidate.fit_all(candidates, self.games_number,
+                                     self.tetrominos_in_single_game, stream,
+                                     racing)
 
         # many computers many threads
         elif self.fit_type == GeneticAlgorithm.fit_types["socket"]:
             g, t = self.games_number, self.tetrominos_in_single_game
-
-            for c in candidates:
-                c.auto_save = False
-
-            candidates = list(map(lambda x: (x, g, t), candidates))
-            candidates = self.server.send_data_to_compute(
-                candidates, "multiprocess_map", "parallel_map_fun"
+            jobs = [pack_job(c.parameters, 0, g, t, stream, racing)
+                    for c in candidates]
+            records = self.server.send_data_to_compute(
+                jobs, "multiprocess_map", "fit_job"
             )
-            if self.load_files:
-                for c in candidates:
-                    c.save()
+            for candidate, (won, lines, played, _seconds) \
+                    in zip(candidates, records):
+                candidate.set_fitness(won, lines, played, g)
             return candidates
 
+    def _log_saved_games(self):
+        if not self.racing:
+            return
+        total = len(self.offsprings) * self.games_number
+        played = sum(c.games_played for c in self.offsprings)
+        eliminated = sum(c.eliminated for c in self.offsprings)
+        logger.info("{} racing saved games: {}/{}, eliminated: {}"
+                    .format(self.generation, total - played, total,
+                            eliminated))
+
     def _is_end_condition(self) -> bool:
         """test if algorithm can be ended"""
 
@@ -172,6 +346,9 @@ class GeneticAlgorithm:
 
     def _create_offsprings(self):
         """create new offsprings selecting all parents independently"""
+        if self.numpy_operators:
+            return self._create_offsprings_numpy()
+
         offsprings = []
         for i in range(self.offsprings_num):
             parent_a = self._select_one_parent()
@@ -181,8 +358,26 @@ class GeneticAlgorithm:
 
         self.offsprings: List[Candidate] = offsprings
 
+    def _create_offsprings_numpy(self):
+        parameters, won, lines = population_arrays(self.population)
+        parents = tournament(self.rng, won, lines, 2 * self.offsprings_num,
+                             self.parents_num_in_tournament)
+        a, b = parents[:self.offsprings_num], parents[self.offsprings_num:]
+        children = normalize(crossover(parameters[a], parameters[b],
+                                       lines[a], lines[b]))
+        self.offsprings = [self._candidate(p) for p in children]
+
+    def _candidate(self, parameters: np.ndarray) -> Candidate:
+        """return candidate of already normalized parameters"""
+        candidate = Candidate(auto_save=self.load_files)
+        candidate.parameters = Parameters(*map(float, parameters))
+        return candidate
+
     def _mutate_offsprings(self):
         """can change parameters of offsprings"""
+        if self.numpy_operators:
+            return self._mutate_offsprings_numpy()
+
         for child_id in range(len(self.offsprings)):
             if random() < self.mutation_chance:
                 mutation: float = uniform(-1, 1) * self.mutation_max_value
@@ -198,23 +393,35 @@ class GeneticAlgorithm:
                 self.offsprings[child_id] = \
                     Candidate(Parameters(*args), auto_save=self.load_files)
 
+    def _mutate_offsprings_numpy(self):
+        parameters = np.array([c.parameters for c in self.offsprings])
+        parameters, mutated = mutate(self.rng, parameters,
+                                     self.mutation_chance,
+                                     self.mutation_max_value)
+        parameters = normalize(parameters)
+        for child_id in np.flatnonzero(mutated):
+            self.offsprings[child_id] = self._candidate(parameters[child_id])
+
     def _select_survivors(self):
-        """replace worst candidate with offsprings"""
-        self.population.sort(reverse=True)
-        to_delete = self.population[-self.offsprings_num:]
-        if self.load_files:
-            self._delete_files(to_delete)
-        self.population = self.population[:-self.offsprings_num]
-        self.population.extend(self.offsprings)
+        """
+        replace worst candidate with offsprings, offsprings eliminated
+        by racing are dropped and worst candidates stay instead of them
+        """
+        offsprings = [c for c in self.offsprings if not c.eliminated]
+        if self.numpy_operators:
+            order = fitness_order(*population_arrays(self.population)[1:])
+            self.population = [self.population[i] for i in order]
+        else:
+            self.population.sort(reverse=True)
+        survivors = self.num_of_population - len(offsprings)
+        if self.store is not None:
+            self.store.remove(self.population[survivors:], self.generation)
+            self.store.add(offsprings, self.generation)
+            self._save_store()
+        self.population = self.population[:survivors]
+        self.population.extend(offsprings)
         self.offsprings = None
 
-    @staticmethod
-    def _delete_files(to_delete: List[Candidate]):
-        for candidate in to_delete:
-            filename = directory + candidate.get_name()
-            logger.debug("deleting file: {}".format(filename))
-            os.remove(filename)
-
     def __str__(self):
         if self.population:
             counter = 0
@@ -229,26 +436,102 @@ class GeneticAlgorithm:
 
     def find_best_parameters(self) -> Parameters:
         """find best parameters for current settings"""
+        self.generation = 0
         self._generate_population()
+        if self.steady_state:
+            return self._find_best_parameters_steady()
 
-        generation = 0
         while not self._is_end_condition():
-            logger.info("{} game won: {}".format(generation, self))
-            generation += 1
+            logger.info("{} game won: {}".format(self.generation, self))
+            self.generation += 1
 
             self._create_offsprings()
             self._mutate_offsprings()
-            self.offsprings = self._fit_all(self.offsprings)
+            self.offsprings = self._fit_all(self.offsprings, self._racing())
+            self._log_saved_games()
             self._select_survivors()
 
         best_candidate: Candidate = max(self.population)
         self.population = None
         return best_candidate.parameters
 
+    def _find_best_parameters_steady(self) -> Parameters:
+        """
+        steady state evolution, generation is counted after every
+        offsprings_num fitted offspring
+        """
+        task_ids = itertools.count()
+        running = {}
+        for _ in range(self.offsprings_num):
+            self._submit_offspring(next(task_ids), running)
+
+        fitted = 0
+        while not self._is_end_condition():
+            task_id, (won, lines, played, _seconds) = self._result()
+            offspring = running.pop(task_id)
+            offspring.set_fitness(won, lines, played, self.games_number)
+            self._replace_worst(offspring)
+
+            fitted += 1
+            if fitted % self.offsprings_num == 0:
+                self.generation += 1
+                logger.info("{} game won: {}".format(self.generation, self))
+                if self.store is not None:
+                    self._save_store()
+            self._submit_offspring(next(task_ids), running)
+
+        # results of running offspring are taken, so workers can be reused
+        for _ in range(len(running)):
+            self._result()
+        if self.store is not None:
+            self._save_store()
+
+        best_candidate: Candidate = max(self.population)
+        self.population = None
+        return best_candidate.parameters
+
+    def _submit_offspring(self, task_id: int, running: dict):
+        """breed one offspring and send it to be fitted"""
+        self.offsprings = [self._select_one_parent().crossover(
+            self._select_one_parent())]
+        self._mutate_offsprings()
+        offspring = running[task_id] = self.offsprings.pop()
+        self.offsprings = None
+
+        racing = None
+        if self.racing:
+            racing = Racing(min(self.population).fitness,
+                            self.racing_confidence)
+        job = pack_job(offspring.parameters, 0, self.games_number,
+                       self.tetrominos_in_single_game, self._piece_stream(),
+                       racing)
+        if self.fit_type == GeneticAlgorithm.fit_types["socket"]:
+            self.server.submit(task_id, job, "multiprocess_map", "fit_job")
+        else:
+            if self.pool is None:
+                self.pool = worker_pool()
+            self.pool.submit(task_id, job)
+
+    def _result(self):
+        """return task id and record of any fitted offspring"""
+        if self.fit_type == GeneticAlgorithm.fit_types["socket"]:
+            return self.server.result()
+        return self.pool.result()
+
+    def _replace_worst(self, offspring: Candidate):
+        """offspring replaces the worst candidate when it is better"""
+        worst = min(self.population)
+        if offspring.eliminated or not worst < offspring:
+            return
+        self.population.remove(worst)
+        self.population.append(offspring)
+        if self.store is not None:
+            self.store.remove([worst], self.generation)
+            self.store.add([offspring], self.generation)
+
     def _start_socket(self):
         self.server = Server(DEFAULT_HOST, DEFAULT_PORT,
-                             self.REQUIRED_DIR, self.REQUIRED_FILES,
-                             GeneticAlgorithm.receive_function)
+                             self.REQUIRED_DIR, self.REQUIRED_FILES)
         self.server.start_server()
 
     def __enter__(self):
@@ -257,6 +540,9 @@ class GeneticAlgorithm:
     def __exit__(self, exc_type, exc_value, traceback):
         if self.fit_type == GeneticAlgorithm.fit_types["socket"]:
             self.server.stop_server()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
 
 
 if __name__ == "__main__":
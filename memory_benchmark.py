@@ -0,0 +1,94 @@
+"""
+print memory footprint of single objects used by genetic algorithm,
+before - dict based objects with layout used before __slots__
+"""
+from candidate import Candidate, Fitness
+from tetris.board import Board
+from tetris.bit_board import BitBoard
+from tetris.tetromino import Tetromino
+from tetris.tetris_ai import Parameters
+from typing import Callable, Tuple
+import numpy as np
+from random import uniform
+import pickle
+import tracemalloc
+import uuid
+
+NUMBER_OF_OBJECTS = 10000
+
+
+def measure(factory: Callable[[], object],
+            number: int = NUMBER_OF_OBJECTS) -> Tuple[float, int]:
+    """return allocated bytes per object and size of pickled object"""
+    tracemalloc.start()
+    start, _peak = tracemalloc.get_traced_memory()
+    objects = [factory() for _ in range(number)]
+    end, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (end - start) / number, len(pickle.dumps(objects[0]))
+
+
+class OldCandidate:
+    """layout of Candidate before __slots__, id kept as uuid.UUID"""
+
+    def __init__(self):
+        self.parameters = Candidate.normalize(Parameters(
+            uniform(-1, 0), uniform(0, 1), uniform(-1, 0), uniform(-1, 0)))
+        self.fitness = Fitness(10, 1000)
+        self.id = uuid.uuid4()
+        self.auto_save = False
+
+
+class OldTetromino:
+    """layout of Tetromino before __slots__ and shared rotations"""
+
+    def __init__(self, shape: str = "T", rotation: int = 0):
+        self.shape = shape
+        self.rotation = rotation
+
+
+class OldBoard:
+    """layout of Board before __slots__ and incremental state"""
+
+    def __init__(self, height=20, width=10):
+        self.height = height
+        self.width = width
+        self.cells = np.zeros(shape=(height, width), dtype=int)
+        self.highest_block = np.zeros(width, dtype=int)
+        self.holes = np.zeros(width, dtype=int)
+        self.counter = 0
+        self.clean_lines = 0
+
+
+def fitted_candidate() -> Candidate:
+    return Candidate(fitness=Fitness(10, 1000))
+
+
+def rotations() -> list:
+    return list(Tetromino("T").gen_rotation())
+
+
+def old_rotations() -> list:
+    return [OldTetromino("T", rotation) for rotation in range(4)]
+
+
+# (name, factory before, factory after)
+FACTORIES = [
+    ("Candidate", OldCandidate, fitted_candidate),
+    ("Tetromino", OldTetromino, Tetromino),
+    ("Tetromino rotations", old_rotations, rotations),
+    ("Board", OldBoard, Board),
+    ("BitBoard", OldBoard, BitBoard),
+]
+
+
+if __name__ == "__main__":
+    print("{:<20} {:>12} {:>12} {:>12} {:>12}".format(
+        "object", "bytes before", "bytes after",
+        "pickled before", "pickled after"))
+    for name, before, after in FACTORIES:
+        old_size, old_pickled = measure(before)
+        size, pickled = measure(after)
+        print("{:<20} {:>12.1f} {:>12.1f} {:>12} {:>12}".format(
+            name, old_size, size, old_pickled, pickled))
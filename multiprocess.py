@@ -1,6 +1,6 @@
 import logging
 import multiprocessing
-from typing import Iterable, Callable, TypeVar, List
+from typing import Iterable, Callable, TypeVar, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -8,7 +8,10 @@ T = TypeVar('T')
 M = TypeVar('M')
 
 
-def fun(f: Callable[[T], M], q_in, q_out):
+def fun(f: Callable[[T], M], q_in, q_out,
+        initializer: Optional[Callable[[], None]] = None):
+    if initializer is not None:
+        initializer()
     while True:
         i, x = q_in.get()
         if i is None:
@@ -18,24 +21,56 @@ def fun(f: Callable[[T], M], q_in, q_out):
         logger.debug("id: {}, status: {}".format(i, str(f_x)))
 
 
-def parallel_map(map_function: Callable[[T], M], data: Iterable[T],
-                 n_process: int = multiprocessing.cpu_count()) -> List[M]:
-    q_in = multiprocessing.Queue(1)
-    q_out = multiprocessing.Queue()
+class WorkerPool:
+    """
+    processes started once and reused by every map call,
+    initializer - called once in every worker before first task
+    """
+
+    def __init__(self, map_function: Callable[[T], M],
+                 n_process: int = multiprocessing.cpu_count(),
+                 initializer: Optional[Callable[[], None]] = None):
+        self.q_in = multiprocessing.Queue(1)
+        self.q_out = multiprocessing.Queue()
+        self.processes = [
+            multiprocessing.Process(target=fun,
+                                    args=(map_function, self.q_in,
+                                          self.q_out, initializer))
+            for _ in range(n_process)
+        ]
+
+        for p in self.processes:
+            p.daemon = True
+            p.start()
+
+    def map(self, data: Iterable[T]) -> List[M]:
+        """return results of map function in order of data"""
+        sent = [self.submit(i, x) for i, x in enumerate(data)]
+        res = [self.result() for _ in range(len(sent))]
+        return [x for i, x in sorted(res, key=lambda r: r[0])]
 
-    processes = [
-        multiprocessing.Process(target=fun, args=(map_function, q_in, q_out))
-        for _ in range(n_process)
-    ]
+    def submit(self, i, x: T):
+        """send task to first free worker, i identifies its result"""
+        assert self.processes, "pool is closed"
+        self.q_in.put((i, x))
 
-    for p in processes:
-        p.daemon = True
-        p.start()
+    def result(self) -> Tuple[object, M]:
+        """return (i, result) of any finished task"""
+        return self.q_out.get()
 
-    sent = [q_in.put((i, x)) for i, x in enumerate(data)]
-    [q_in.put((None, None)) for _ in range(n_process)]
-    res = [q_out.get() for _ in range(len(sent))]
+    def close(self):
+        [self.q_in.put((None, None)) for _ in self.processes]
+        [p.join() for p in self.processes]
+        self.processes = []
 
-    [p.join() for p in processes]
+    def __enter__(self):
+        return self
 
-    return [x for i, x in sorted(res)]
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parallel_map(map_function: Callable[[T], M], data: Iterable[T],
+                 n_process: int = multiprocessing.cpu_count()) -> List[M]:
+    with WorkerPool(map_function, n_process) as pool:
+        return pool.map(data)
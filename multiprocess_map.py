@@ -1,19 +1,263 @@
-from multiprocess import parallel_map
-from typing import Tuple, List
-from candidate import Candidate
+from multiprocess import WorkerPool
+from typing import Tuple, List, Optional
+from collections import deque
+from candidate import Candidate, Fitness, Racing, RACING_GAMES, play, \
+    get_pieces
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from tetris.tetris_ai import Parameters
+from tetris.piece_stream import PieceStream
+from tetris import vectorized
+import numpy as np
 import logging
+import struct
+import time
 
 logger = logging.getLogger(__name__)
 
+# wanted time of one chunk of games, chunks should be long enough to
+# hide cost of messages and short enough to keep all workers busy
+CHUNK_SECONDS = 0.5
+# games in chunks sent before time of game is measured
+FIRST_CHUNK = 2
 
-def map_function(candid_games_tetrominos: Tuple[Candidate, int, int]):
-    if isinstance(candid_games_tetrominos, int):
-        print("not iterable")
-    logger.debug("map function with arg: {}".format(candid_games_tetrominos))
-    candid, games, tetrominos = candid_games_tetrominos
-    return candid.fit(games, tetrominos)
 
+# packed parameters, first game, number of games, tetrominos in game,
+# seed and bag of piece stream, racing threshold and confidence
+Job = Tuple[bytes, int, int, int, Optional[Tuple[int, ...]], bool,
+            Optional[Tuple[int, int, Optional[float]]]]
+# won games, clean lines, played games, time of games in seconds
+Record = Tuple[int, int, int, float]
 
-def parallel_map_fun(candid_game_tetromino: List[Tuple[Candidate, int, int]]):
-    logger.debug("parallel map fun")
-    return parallel_map(map_function, candid_game_tetromino)
+PARAMETERS_FORMAT = "4d"
+
+
+def pack_job(parameters: Parameters, first_game: int, games: int,
+             tetrominos: int, stream: PieceStream = None,
+             racing: Racing = None) -> Job:
+    """return job with only numbers, so it is cheap to send"""
+    seed, bag = (stream.seed, stream.bag) if stream else (None, False)
+    if racing:
+        racing = (*racing.threshold, racing.confidence)
+    return (struct.pack(PARAMETERS_FORMAT, *parameters), first_game, games,
+            tetrominos, seed, bag, racing)
+
+
+def fit_job(job: Job) -> Record:
+    """play games described by job"""
+    parameters, first_game, games, tetrominos, seed, bag, racing = job
+    start = time.perf_counter()
+    parameters = struct.unpack(PARAMETERS_FORMAT, parameters)
+    if seed is not None:
+        pieces = PieceStream(seed, bag).pieces(games, tetrominos, first_game)
+    else:
+        pieces = vectorized.random_pieces(games, tetrominos)
+    if racing:
+        racing = Racing(Fitness(*racing[:2]), racing[2])
+
+    won, clean_lines, played = play(parameters, pieces, racing)
+    return won, clean_lines, played, time.perf_counter() - start
+
+
+# name, shape and dtype of numpy array in shared memory
+SharedArray = Tuple[str, Tuple[int, ...], str]
+# parameters, pieces and results of generation, slot of candidate,
+# first game, number of games
+SharedJob = Tuple[Tuple[SharedArray, SharedArray, SharedArray],
+                  int, int, int]
+
+# shared memory opened by worker, kept for all jobs of generation
+_attached = {}
+
+
+class SharedGeneration:
+    """
+    parameters (N, 4), pieces (G, T) and results (2, N, G) of generation
+    in shared memory, workers read parameters and pieces and write won
+    games and clean lines of every game, so only small jobs are pickled
+    """
+
+    def __init__(self, parameters: np.ndarray, pieces: np.ndarray):
+        self._memory = []
+        self._arrays = []
+        self.parameters = self._share(np.asarray(parameters, np.float64))
+        self.pieces = self._share(pieces)
+        self.results = self._share(
+            np.zeros((2, len(parameters), len(pieces)), dtype=np.int32))
+
+    def _share(self, array: np.ndarray) -> np.ndarray:
+        memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, array.dtype, buffer=memory.buf)
+        shared[...] = array
+        self._memory.append(memory)
+        self._arrays.append((memory.name, array.shape, array.dtype.str))
+        return shared
+
+    def job(self, slot: int, first_game: int, games: int) -> SharedJob:
+        return tuple(self._arrays), slot, first_game, games
+
+    def close(self):
+        self.parameters = self.pieces = self.results = None
+        for memory in self._memory:
+            memory.close()
+            memory.unlink()
+        self._memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _attach(array: SharedArray) -> np.ndarray:
+    name, shape, dtype = array
+    if name not in _attached:
+        _attached[name] = SharedMemory(name)
+    return np.ndarray(shape, dtype, buffer=_attached[name].buf)
+
+
+def _detach(arrays: Tuple[SharedArray, ...]):
+    """close shared memory of previous generations"""
+    names = {name for name, _shape, _dtype in arrays}
+    for name in [name for name in _attached if name not in names]:
+        _attached.pop(name).close()
+
+
+def fit_shared_job(job: SharedJob) -> Tuple[int, float]:
+    """
+    play games of shared generation, results are written to shared
+    memory, return number of games and time of games in seconds
+    """
+    arrays, slot, first_game, games = job
+    start = time.perf_counter()
+    _detach(arrays)
+    parameters, pieces, results = map(_attach, arrays)
+
+    won, clean_lines = vectorized.play_games(
+        pieces[first_game:first_game + games], parameters[slot])
+    results[0, slot, first_game:first_game + games] = won
+    results[1, slot, first_game:first_game + games] = clean_lines
+    return games, time.perf_counter() - start
+
+
+def warm_up():
+    """build placement tables before first task"""
+    vectorized.get_shape_arrays(10)
+
+
+def worker_pool(shared: bool = False) -> WorkerPool:
+    """
+    return pool fitting chunks, it can be reused by many generations,
+    shared - pool for fit_candidates with shared memory
+    """
+    if shared:
+        # workers have to share tracker of parent, their own trackers
+        # would remove shared memory attached by them at exit
+        resource_tracker.ensure_running()
+    function = fit_shared_job if shared else fit_job
+    return WorkerPool(function, initializer=warm_up)
+
+
+def _chunk_size(seconds_per_game: float, unsent: int, workers: int,
+                racing: Racing) -> int:
+    """
+    return number of games in next chunk, at the end of generation
+    remaining games are spread over all workers
+    """
+    if seconds_per_game is None:
+        size = FIRST_CHUNK
+    else:
+        size = int(CHUNK_SECONDS / max(seconds_per_game, 1e-6))
+    size = min(size, -(-unsent // workers))
+    if racing:
+        size = min(size, RACING_GAMES)
+    return max(size, 1)
+
+
+def fit_candidates(pool: WorkerPool, candidates: List[Candidate],
+                   games_number: int, tetrominos_in_single_game: int,
+                   stream: PieceStream = None, racing: Racing = None,
+                   shared: bool = False) -> List[Candidate]:
+    """
+    calculate fitness of candidates by chunks of games played by workers,
+    size of chunks follows measured time of games,
+    results of chunks are summed to fitness of every candidate,
+    shared - parameters, pieces and results are passed by shared memory,
+    pool has to be created by worker_pool(shared=True)
+    """
+    if not shared:
+        return _fit_candidates(pool, candidates, games_number,
+                               tetrominos_in_single_game, stream, racing)
+
+    parameters = np.array([c.parameters for c in candidates])
+    pieces = get_pieces(games_number, tetrominos_in_single_game, stream)
+    with SharedGeneration(parameters, pieces) as generation:
+        return _fit_candidates(pool, candidates, games_number,
+                               tetrominos_in_single_game, stream, racing,
+                               generation)
+
+
+def _fit_candidates(pool, candidates, games_number,
+                    tetrominos_in_single_game, stream, racing,
+                    generation: SharedGeneration = None):
+    n = len(candidates)
+    won, clean_lines, played = [0] * n, [0] * n, [0] * n
+    sent, settled = [0] * n, [False] * n
+    unsent = n * games_number
+    workers = len(pool.processes)
+    seconds_per_game = None
+
+    waiting = deque(i for i in range(n) if games_number > 0)
+    running = {}
+    task_id = 0
+    while waiting or running:
+        while waiting and len(running) <= workers:
+            i = waiting.popleft()
+            if settled[i]:
+                continue
+
+            size = _chunk_size(seconds_per_game, unsent, workers, racing)
+            size = min(size, games_number - sent[i])
+            if generation:
+                job = generation.job(i, sent[i], size)
+            else:
+                job = pack_job(candidates[i].parameters, sent[i], size,
+                               tetrominos_in_single_game, stream)
+            pool.submit(task_id, job)
+            running[task_id] = i, sent[i], size
+            task_id += 1
+            sent[i] += size
+            unsent -= size
+            if sent[i] < games_number:
+                waiting.append(i)
+        if not running:
+            continue
+
+        task, result = pool.result()
+        i, first_game, size = running.pop(task)
+        if generation:
+            games, seconds = result
+            chunk = generation.results[:, i, first_game:first_game + size]
+            w, lines = (int(x) for x in chunk.sum(axis=1))
+        else:
+            w, lines, games, seconds = result
+        won[i], clean_lines[i] = won[i] + w, clean_lines[i] + lines
+        played[i] += games
+
+        game_seconds = seconds / size
+        if seconds_per_game is None:
+            seconds_per_game = game_seconds
+        else:
+            seconds_per_game = (seconds_per_game + game_seconds) / 2
+
+        if racing and not settled[i] \
+                and racing.is_settled(won[i], played[i], games_number):
+            settled[i] = True
+            unsent -= games_number - sent[i]
+
+    logger.debug("fitted {} candidates in {} chunks".format(n, task_id))
+    for i, candidate in enumerate(candidates):
+        candidate.set_fitness(won[i], clean_lines[i], played[i],
+                              games_number)
+    return candidates
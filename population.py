@@ -0,0 +1,65 @@
+from candidate import Candidate
+from typing import List, Tuple
+import numpy as np
+
+
+def population_arrays(candidates: List[Candidate]) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """return (N, 4) parameters, (N,) won games and (N,) clean lines"""
+    parameters = np.array([c.parameters for c in candidates], dtype=float)
+    fitness = np.array([c.fitness for c in candidates], dtype=np.int64)
+    return parameters.reshape(-1, 4), fitness[:, 0], fitness[:, 1]
+
+
+def normalize(parameters: np.ndarray) -> np.ndarray:
+    """normalize every row to length 1, as Candidate.normalize"""
+    return parameters / np.linalg.norm(parameters, axis=1, keepdims=True)
+
+
+def fitness_order(won: np.ndarray, lines: np.ndarray) -> np.ndarray:
+    """return indexes from the best to the worst, as sorting candidates"""
+    return np.lexsort((lines, won))[::-1]
+
+
+def tournament(rng: np.random.Generator, won: np.ndarray, lines: np.ndarray,
+               parents: int, size: int) -> np.ndarray:
+    """return indexes of parents, winners of tournaments of size members"""
+    rank = np.empty(len(won), dtype=np.intp)
+    rank[fitness_order(won, lines)] = np.arange(len(won))[::-1]
+    members = rng.integers(0, len(won), (parents, size))
+    winners = np.argmax(rank[members], axis=1)
+    return members[np.arange(parents), winners]
+
+
+def crossover(parameters_a: np.ndarray, parameters_b: np.ndarray,
+              lines_a: np.ndarray, lines_b: np.ndarray) -> np.ndarray:
+    """
+    return parameters of children weighted by clean lines of parents,
+    as Candidate.crossover, children are not normalized
+    """
+    div = (lines_a + lines_b).astype(float)
+    weight_a = np.divide(lines_a, div, out=np.full(len(div), 0.5),
+                         where=div != 0)
+    weight_b = np.divide(lines_b, div, out=np.full(len(div), 0.5),
+                         where=div != 0)
+    children = weight_a[:, None] * parameters_a \
+        + weight_b[:, None] * parameters_b
+    children[:, 1] = np.abs(children[:, 1])
+    return children
+
+
+def mutate(rng: np.random.Generator, parameters: np.ndarray, chance: float,
+           max_value: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    return parameters where one random parameter of chance of rows is
+    changed by at most max_value and mask of changed rows
+    """
+    n = len(parameters)
+    mutated = rng.random(n) < chance
+    index = rng.integers(0, parameters.shape[1], n)
+    change = rng.uniform(-1, 1, n) * max_value
+
+    parameters = parameters.copy()
+    rows = np.flatnonzero(mutated)
+    parameters[rows, index[rows]] += change[rows]
+    return parameters, mutated
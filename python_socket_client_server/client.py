@@ -1,15 +1,28 @@
 from .connection import *
 import os
 import sys
-import shutil
-from typing import Optional, IO, List, Tuple
+import hashlib
+from typing import List, Tuple
 import argparse
 import multiprocessing
+import threading
 import logging
+from concurrent.futures import ProcessPoolExecutor, Future
+from functools import partial
 
 DIRECTORY = "./downloaded/"
+# files of DIRECTORY by their SHA-256, kept between runs
+CACHE = ".cache/"
+
+# required dirs and required files with SHA-256 of their content
+Manifest = Tuple[List[str], List[Tuple[str, str]]]
 THREADS = 8
 DECLARED_WORK = 8
+# batches of DECLARED_WORK items computed or waiting at once
+CREDITS = 2
+# compressions of messages accepted by client, the first one known by
+# server is used by both sides
+COMPRESSIONS = ('zlib', 'lzma')
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -44,41 +57,62 @@ class Client:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
         self.map_function = None
+        self.executor = None
+        self.send_lock = threading.Lock()
+        self.compression = None
 
         self.directory = directory
         cur_path = os.path.dirname(os.path.abspath(__file__))
         sys.path.append(cur_path + directory[1:])
 
-    def _download_file(self):
-        if os.path.exists(self.directory):
-            shutil.rmtree(self.directory[:-1])
-        os.makedirs(self.directory)
-
-        dir_num = receive(self.sock)
-        for i in range(dir_num):
-            dir_name = receive(self.sock)
-            os.makedirs(self.directory + dir_name)
-
-        files_num = receive(self.sock)
-        for i in range(files_num):
-            filename = receive(self.sock)
-            data = receive(self.sock)
-            with open(self.directory + filename, 'w') \
-                    as new_file:  # type: Optional[IO[str]]
-                print(data, file=new_file, end='')
+    def _cached(self, digest: str) -> str:
+        return self.directory + CACHE + digest
+
+    def _missing_files(self, manifest: Manifest) -> List[str]:
+        """return hashes of required files which are not in cache"""
+        return [digest for _name, digest in manifest[1]
+                if not os.path.exists(self._cached(digest))]
+
+    def _download_files(self):
+        """store received files in cache, content is checked by hash"""
+        os.makedirs(self.directory + CACHE, exist_ok=True)
+        for digest, data in receive(self.sock).items():
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise IOError("file {} is corrupted".format(digest))
+            _write_file(self._cached(digest), data)
+
+    def _install_files(self, manifest: Manifest):
+        """copy required files from cache, only changed files are written"""
+        for dir_name in manifest[0]:
+            os.makedirs(self.directory + dir_name, exist_ok=True)
+
+        for name, digest in manifest[1]:
+            with open(self._cached(digest), 'rb') as file:
+                data = file.read()
+            name = self.directory + name
+            if os.path.exists(name):
+                with open(name, 'rb') as file:
+                    if file.read() == data:
+                        continue
+            logger.debug("installing file '{}'".format(name))
+            _write_file(name, data)
 
     def start_client(self):
-        response = receive(self.sock)
-        logger.debug("needed dir and files {}".format(response))
-
-        if not self._has_all_files(response):
-            send(MessageType.download, self.sock)
-            logger.debug("downloading modules")
-            self._download_file()
+        manifest = receive(self.sock)
+        logger.debug("needed dir and files {}".format(manifest))
+
+        missing = self._missing_files(manifest)
+        if missing:
+            send_batch([MessageType.download, missing], self.sock)
+            logger.debug("downloading {} modules".format(len(missing)))
+            self._download_files()
             logger.debug("modules downloaded")
+        self._install_files(manifest)
 
-        send(MessageType.get_work, self.sock)
-        send(DECLARED_WORK, self.sock)
+        send_batch([MessageType.get_work,
+                    (DECLARED_WORK, CREDITS, COMPRESSIONS)], self.sock)
+        self.compression = receive(self.sock)
+        self.executor = ProcessPoolExecutor(THREADS)
 
         while True:
             logger.debug("waiting for orders")
@@ -90,44 +124,48 @@ class Client:
 
             if order == MessageType.end:
                 logger.debug("message from server: end")
-                self.sock.close()
                 break
 
             elif order == MessageType.compute:
                 server_args = receive(self.sock)
-                server_id, function_args = list(zip(*server_args))
 
                 module_name, function_name = receive(self.sock)
                 logger.debug("received module: '{}', function: '{}'"
                              .format(module_name, function_name))
                 self._prepare_function(module_name, function_name)
 
-                function_result = self.map_function[2](function_args)
-
-                client_result = list(zip(server_id, function_result))
-                send(client_result, self.sock)
+                for server_id, function_arg in server_args:
+                    future = self.executor.submit(self.map_function[2],
+                                                  function_arg)
+                    future.add_done_callback(
+                        partial(self._send_result, server_id))
 
             else:
                 logger.warning("unexpected message from server")
                 break
 
-    def _has_all_files(self, files: Tuple[List[str], List[Tuple[str, int]]]):
-        for name in files[0]:
-            name = self.directory + name
-            if not os.path.exists(name):
-                return False
-
-        for name, size in files[1]:
-            name = self.directory + name
-            if not os.path.exists(name):
-                # logger.debug("file doesn't exist '{}'".format(name))
-                return False
-            if os.stat(name).st_size != size:
-                # logger.debug("file '{}' has wrong size,"
-                #              " should be {}, but is {}"
-                #              .format(name, os.stat(name).st_size, size))
-                return False
-        return True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self.send_lock:
+            self.sock.close()
+
+    def _send_result(self, server_id, future: Future):
+        """send result of single item as soon as it is computed"""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning("task {} failed: {!r}"
+                           .format(server_id, future.exception()))
+            result = ComputeError(repr(future.exception()))
+        else:
+            result = future.result()
+
+        with self.send_lock:
+            if self.sock.fileno() == -1:
+                return
+            try:
+                send((server_id, result), self.sock, self.compression)
+            except OSError:
+                logger.warning("result {} not sent".format(server_id))
 
     def _prepare_function(self, module_name, function_name):
         if ((not self.map_function
@@ -144,6 +182,14 @@ class Client:
             self.map_function = (module_name, function_name, loc['_ret'])
 
 
+def _write_file(name: str, data: bytes):
+    """replace file at once, so running imports never see part of it"""
+    temporary = name + ".tmp"
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, name)
+
+
 if __name__ == "__main__":
     c = Client(args.host, args.port)
     c.start_client()
@@ -1,7 +1,13 @@
+import asyncio
+import collections
 import socket
 import struct
 import logging
+import lzma
 import pickle
+import weakref
+import zlib
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -15,31 +21,113 @@ class MessageType:
     compute = 'compute'
 
 
-def send(msg, sock: socket.SocketType):
-    msg = pickle.dumps(msg)
-    val = struct.pack('!i', len(msg))
+class ComputeError(Exception):
+    """function raised exception on worker, sent instead of result"""
+    pass
+
+
+# frame header: length of payload and flags
+HEADER = struct.Struct('!QB')
+# flags of frame
+ZLIB, LZMA, BATCH = 1, 2, 4
+COMPRESSIONS = {'zlib': (ZLIB, zlib.compress, zlib.decompress),
+                'lzma': (LZMA, lzma.compress, lzma.decompress)}
+# smaller payloads are not compressed
+COMPRESS_MIN = 1024
+
+# messages of received batch frames which were not returned yet
+_pending = weakref.WeakKeyDictionary()
+
+
+def choose_compression(offered) -> Optional[str]:
+    """return first offered compression known by this side"""
+    for name in offered or ():
+        if name in COMPRESSIONS:
+            return name
+    return None
+
+
+def _pack(msgs: list, compression: Optional[str]) -> Tuple[bytes, bytes]:
+    """return header and payload of frame with one or more messages"""
+    flags = 0
+    if len(msgs) == 1:
+        payload = pickle.dumps(msgs[0], pickle.HIGHEST_PROTOCOL)
+    else:
+        flags |= BATCH
+        payload = pickle.dumps(msgs, pickle.HIGHEST_PROTOCOL)
+
+    if compression and len(payload) >= COMPRESS_MIN:
+        flag, compress, _decompress = COMPRESSIONS[compression]
+        compressed = compress(payload)
+        if len(compressed) < len(payload):
+            flags, payload = flags | flag, compressed
+    return HEADER.pack(len(payload), flags), payload
+
+
+def _unpack(flags: int, payload, key):
+    """return first message of frame, others are kept for key"""
+    for _name, (flag, _compress, decompress) in COMPRESSIONS.items():
+        if flags & flag:
+            payload = decompress(payload)
+    msg = pickle.loads(payload)
+    if not flags & BATCH:
+        return msg
+    _pending[key] = collections.deque(msg[1:])
+    return msg[0]
+
+
+def send(msg, sock: socket.SocketType, compression: str = None):
+    send_batch([msg], sock, compression)
+
+
+def send_batch(msgs: list, sock: socket.SocketType, compression: str = None):
+    """send messages in one frame, they are received one by one"""
+    header, payload = _pack(msgs, compression)
     try:
-        sock.sendall(val)
-        sock.sendall(msg)
+        sent = sock.sendmsg([header, payload])
+        if sent < len(header):
+            sock.sendall(header[sent:])
+            sent = len(header)
+        sock.sendall(memoryview(payload)[sent - len(header):])
     except BrokenPipeError:
         return
 
 
-def receive(sock: socket.SocketType):
-    buf = b''
-    while len(buf) < 4:
-        chunk = sock.recv(4)
-        if not chunk:
+def _receive_exactly(sock: socket.SocketType, size: int) -> bytearray:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
             raise IOError("socket connection broken")
-        buf += chunk
-    length = struct.unpack('!i', buf[:4])[0]
-    bytes_recd = len(buf) - 4
+        view = view[received:]
+    return buf
 
-    while bytes_recd < length:
-        chunk = sock.recv(min(length - bytes_recd, 2048))
-        if not chunk:
-            raise IOError("socket connection broken")
-        buf += chunk
-        bytes_recd = bytes_recd + len(chunk)
 
-    return pickle.loads(buf[4:])
+def receive(sock: socket.SocketType):
+    if _pending.get(sock):
+        return _pending[sock].popleft()
+    length, flags = HEADER.unpack(_receive_exactly(sock, HEADER.size))
+    return _unpack(flags, _receive_exactly(sock, length), sock)
+
+
+async def send_async(msg, writer: asyncio.StreamWriter,
+                     compression: str = None):
+    await send_batch_async([msg], writer, compression)
+
+
+async def send_batch_async(msgs: list, writer: asyncio.StreamWriter,
+                           compression: str = None):
+    """send messages in one frame, they are received one by one"""
+    writer.writelines(_pack(msgs, compression))
+    await writer.drain()
+
+
+async def receive_async(reader: asyncio.StreamReader):
+    if _pending.get(reader):
+        return _pending[reader].popleft()
+    try:
+        length, flags = HEADER.unpack(await reader.readexactly(HEADER.size))
+        return _unpack(flags, await reader.readexactly(length), reader)
+    except asyncio.IncompleteReadError:
+        raise IOError("socket connection broken")
@@ -1,172 +1,313 @@
-import itertools
-
 from .connection import *
-from typing import List, Callable, Any
+import hashlib
+import itertools
+import queue
+import statistics
+from typing import List, Callable, Any, Tuple
 import threading
 import os
-import select
 import logging
 
-SLEEP_TIME = 3
-CLIENT_TIMEOUT = 1
-
-socket.setdefaulttimeout(CLIENT_TIMEOUT)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# seconds of lease of sent item before any item is computed, it is also
+# the shortest lease
+LEASE_SECONDS = 60.0
+# item is a straggler when it is computed this times longer than median
+STRAGGLER_FACTOR = 4
+# required files are small and sent rarely, so the best ratio is used
+FILES_COMPRESSION = 'lzma'
+
+
+class _Computation:
+    """data sent by one call of send_data_to_compute"""
+
+    def __init__(self, data: List, module_name: str, function_name: str):
+        self.module_name = module_name
+        self.function_name = function_name
+        self.data = data
+        self.size = len(data)
+        self.results = {}
+        self.error = None
+        self.done = asyncio.Event()
+        # deadline of the newest sent copy of every uncomputed item
+        self.leases = {}
+        self.durations = []
+
+    def lease(self, i, now: float, lease_seconds: float):
+        """give item sent at now time to compute"""
+        if self.durations:
+            median = statistics.median(self.durations)
+            lease_seconds = max(lease_seconds, STRAGGLER_FACTOR * median)
+        self.leases[i] = now + lease_seconds
+
+    def expired(self, now: float) -> List[int]:
+        """return items whose newest copy is not computed in time"""
+        return [i for i, deadline in self.leases.items()
+                if deadline < now and i not in self.results]
+
 
 class Server:
+    """
+    event loop of server runs in own thread, every worker connection
+    is served by own coroutines, which send next data as soon as
+    worker has free credit, function is called by worker for every
+    item of data
+    """
+
     def __init__(self, host, port,
                  required_dir: List[str],
                  required_files: List[str],
-                 receive_function: Callable[[Any], Any] = None):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.bind((host, port))
-        self.sock.listen()
-        self.sock.settimeout(SLEEP_TIME)
+                 receive_function: Callable[[Any], Any] = None,
+                 lease_seconds: float = LEASE_SECONDS):
+        """
+        lease_seconds - items not computed in lease are sent again to
+        free workers at the end of computation, lease is longer when
+        median time of computed items is long, see STRAGGLER_FACTOR
+        """
+        self.lease_seconds = lease_seconds
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            self._serve_worker, host, port, reuse_address=True))
 
         logger.info("Server started on {}:{}".format(host, port))
 
-        self.lock = threading.Lock()
         self.workers = {}
-        self.loop_thread = threading.Thread(target=self._server_loop)
-        self.end_flag = threading.Event()
+        self.queue = asyncio.Queue()
+        # every sent item gets new id, so late results are not mixed
+        self.task_ids = itertools.count()
+        # futures of items computed after submit
+        self.finished = queue.Queue()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever)
 
         self.required_dir = required_dir
-        self.required_files = list(map(
-            lambda name: (name, os.stat(name).st_size), required_files
-        ))
+        # manifest of required files and their content by hash
+        self.required_files = []
+        self.file_data = {}
+        for name in required_files:
+            with open(name, 'rb') as file:
+                data = file.read()
+            digest = hashlib.sha256(data).hexdigest()
+            self.required_files.append((name, digest))
+            self.file_data[digest] = data
 
         self.receive_function = receive_function
 
-    def _send_files(self, client):
-        send(len(self.required_dir), client)
-        for dir_name in self.required_dir:
-            send(dir_name, client)
-
-        send(len(self.required_files), client)
-        for filename, _size in self.required_files:
-            with open(filename, 'r') as file:
-                data = file.read()
-                send(filename, client)
-                send(data, client)
+    async def _send_files(self, writer, digests: List[str]):
+        """send content of files missing in cache of worker in one frame"""
+        files = {digest: self.file_data[digest] for digest in digests
+                 if digest in self.file_data}
+        await send_async(files, writer, FILES_COMPRESSION)
 
     def start_server(self):
         self.loop_thread.start()
 
     def stop_server(self):
-        self.end_flag.set()
-        self.loop_thread.join()
-
-    def _server_loop(self):
-        while not self.end_flag.is_set():
-            try:
-                connection, address = self.sock.accept()
-                logger.debug("accepted connection from :{}".format(address))
-            except socket.timeout:
-                logger.debug("no one has been connected")
-                continue
-
+        if self.loop.is_closed():
+            return
+        if self.loop_thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._close_connections(),
+                                             self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+        else:
+            self.loop.run_until_complete(self._close_connections())
+        self.loop.close()
+
+    async def _serve_worker(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        logger.debug("accepted connection from :{}".format(address))
+        try:
+            await send_async((self.required_dir, self.required_files), writer)
+            logger.debug("sent required dir: {} and files: {}"
+                         .format(self.required_dir, self.required_files))
+
+            response = await receive_async(reader)
+            if response == MessageType.download:
+                digests = await receive_async(reader)
+                await self._send_files(writer, digests)
+                logger.debug("{} modules sent".format(len(digests)))
+
+                response = await receive_async(reader)
+
+            if response != MessageType.get_work:
+                logger.warning("unexpected message '{}' from {}"
+                               .format(response, address))
+                await send_async(MessageType.unexpected_message, writer)
+                writer.close()
+                return
+
+            work = await receive_async(reader)
+            quantity, credits, *offered = \
+                work if isinstance(work, tuple) else (work, 1)
+            compression = None
+            if offered:
+                compression = choose_compression(offered[0])
+                await send_async(compression, writer)
+            self.workers[writer] = asyncio.current_task()
+            logger.debug("worker added - address: {}, compression: {}"
+                         .format(address, compression))
+            await self._compute_loop(reader, writer, quantity, credits,
+                                     compression)
+
+        except (IOError, ValueError):
+            logger.warning("socket broken - address: {}".format(address))
+            self.workers.pop(writer, None)
+            writer.close()
+
+    async def _compute_loop(self, reader, writer, quantity: int,
+                            credits: int, compression: str = None):
+        """
+        keep at most credits batches of quantity items sent to worker,
+        worker returns every item separately, so credit of an item is
+        given back as soon as it is computed
+        """
+        credit = asyncio.Semaphore(quantity * credits)
+        sent = {}
+        sender = asyncio.ensure_future(
+            self._send_batches(writer, quantity, credit, sent, compression))
+        try:
+            while True:
+                task_id, returned_data = await receive_async(reader)
+                item, start = sent.pop(task_id, (None, None))
+                credit.release()
+                if item is not None:
+                    computation, i, _data = item
+                    computation.durations.append(self.loop.time() - start)
+                    self._add_result(computation, i, returned_data)
+        finally:
+            sender.cancel()
+            for item, _start in sent.values():
+                self.queue.put_nowait(item)
+
+    async def _send_batches(self, writer, quantity: int,
+                            credit: asyncio.Semaphore, sent: dict,
+                            compression: str = None):
+        """send batches of items, every batch has items of one computation"""
+        held = None
+        try:
+            while True:
+                await credit.acquire()
+                item, held = held or await self.queue.get(), None
+                batch = [item]
+                while len(batch) < quantity and not self.queue.empty() \
+                        and not credit.locked():
+                    item = self.queue.get_nowait()
+                    if item[0] is not batch[0][0]:
+                        held = item
+                        break
+                    await credit.acquire()
+                    batch.append(item)
+
+                computation = batch[0][0]
+                to_send = []
+                now = self.loop.time()
+                for item in batch:
+                    if item[1] in computation.results or computation.error:
+                        credit.release()
+                        continue
+                    task_id = next(self.task_ids)
+                    sent[task_id] = item, now
+                    computation.lease(item[1], now, self.lease_seconds)
+                    to_send.append((task_id, item[2]))
+                if not to_send:
+                    continue
+
+                await send_batch_async(
+                    [MessageType.compute, to_send,
+                     (computation.module_name, computation.function_name)],
+                    writer, compression)
+        except IOError:
+            writer.close()
+        finally:
+            if held is not None:
+                self.queue.put_nowait(held)
+
+    def _add_result(self, computation: _Computation, i, returned_data):
+        """store the first result of item, results of its copies are lost"""
+        if i in computation.results:
+            return
+        computation.leases.pop(i, None)
+        if isinstance(returned_data, ComputeError):
+            computation.error = returned_data
+            computation.done.set()
+            return
+        computation.results[i] = returned_data
+        if self.receive_function:
+            self.receive_function(returned_data)
+        if len(computation.results) == computation.size:
+            logger.info("received computed data num: {}"
+                        .format(computation.size))
+            computation.done.set()
+
+    async def _compute(self, data_to_send: List, module_name: str,
+                       function_name: str) -> List:
+        computation = _Computation(data_to_send, module_name, function_name)
+        for i, data in enumerate(data_to_send):
+            self.queue.put_nowait((computation, i, data))
+        while data_to_send and not computation.done.is_set():
             try:
-                send((self.required_dir, self.required_files), connection)
-                logger.debug("sent required dir: {} and files: {}"
-                             .format(self.required_dir, self.required_files))
-
-                response = receive(connection)
-                if response == MessageType.download:
-                    self._send_files(connection)
-                    logger.debug("modules sent")
-
-                    response = receive(connection)
-
-                if response == MessageType.get_work:
-                    quantity = receive(connection)
-                    with self.lock:
-                        self.workers[connection] = [quantity, False]
-                    logger.debug("worker added - address: {}".format(address))
-                else:
-                    logger.warning("unexpected message '{}' from {}"
-                                   .format(response, address))
-                    send(MessageType.unexpected_message, connection)
-                    connection.close()
-
-            except TimeoutError:
-                logger.warning("timeout error - address: {}".format(address))
-            except IOError:
-                logger.warning("socket broken - address: {}".format(address))
-
-        self._close_connections()
+                await asyncio.wait_for(computation.done.wait(),
+                                       self.lease_seconds / 4)
+            except asyncio.TimeoutError:
+                self._speculate(computation)
+        if computation.error:
+            raise computation.error
+        return [computation.results[i] for i in range(len(data_to_send))]
+
+    def _speculate(self, computation: _Computation):
+        """
+        when all items are sent, send again items of stragglers and of
+        lost workers, so they are computed by free workers
+        """
+        if not self.queue.empty():
+            return
+        expired = computation.expired(self.loop.time())
+        if expired:
+            logger.info("sending again {} items of stragglers"
+                        .format(len(expired)))
+        for i in expired:
+            # new lease starts when copy is sent
+            del computation.leases[i]
+            self.queue.put_nowait((computation, i, computation.data[i]))
+
+    def submit(self, i, data, module_name: str, function_name: str):
+        """compute one item by any worker, i identifies its result"""
+        future = asyncio.run_coroutine_threadsafe(
+            self._compute([data], module_name, function_name), self.loop)
+        future.add_done_callback(lambda f: self.finished.put((i, f)))
+
+    def result(self) -> Tuple[Any, Any]:
+        """return (i, result) of any item computed after submit"""
+        i, future = self.finished.get()
+        return i, future.result()[0]
 
     def send_data_to_compute(self, data_to_send: List,
                              module_name: str, function_name: str) -> List:
-        data_to_send = [(i, d) for i, d in enumerate(data_to_send)]
-        copy = []
-        socket_sent = []
-        ret = []
-
-        while data_to_send:
-            if not copy:
-                logger.debug("copy from data_to_send")
-                copy = data_to_send[:]
-
-            with self.lock:
-                for conn, val in self.workers.items():
-                    (possible, used) = val
-                    if not used:
-                        logger.debug("send to {}".format(conn.getpeername()))
-                        args_to_send = copy[:possible]
-                        copy = copy[possible:]
-                        self.workers[conn][1] = True
-                        socket_sent.append(conn)
-
-                        send(MessageType.compute, conn)
-                        send(args_to_send, conn)
-                        send((module_name, function_name), conn)
-
-            logger.debug("wait for client messages {}".format(
-                list(map(lambda x: x.getpeername(), socket_sent)))
-            )
-            read, _write, errors = select.select(socket_sent, [],
-                                                 socket_sent, SLEEP_TIME)
-
-            with self.lock:
-                for readable in itertools.chain(read, errors):
-                    logger.debug("received msg from {}"
-                                 .format(readable.getpeername()))
-                    socket_sent.remove(readable)
-                    self.workers[readable][1] = False
-                    logger.debug("status restored")
-
-                    try:
-                        received_data = receive(readable)
-                        # logger.debug("received: {}".format(received_data))
-                        returned_i, returned_data = list(zip(*received_data))
-                    except (IOError, TimeoutError, ValueError):
-                        logger.warning("problem with read socket: {}"
-                                       .format(readable))
-                        self.workers.pop(readable)
-                        readable.close()
-                        continue
-
-                    data_to_send = [(i, d) for i, d in data_to_send
-                                    if i not in returned_i]
-                    ret.extend(returned_data)
-                    if self.receive_function:
-                        for returned_object in returned_data:
-                            self.receive_function(returned_object)
-
-                    logger.info("received computed data num: {}"
-                                .format(len(returned_data)))
-
-        return ret
+        """
+        return results computed by workers in order of data_to_send,
+        every item has exactly one result, also when it was sent again
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._compute(data_to_send, module_name, function_name),
+            self.loop
+        ).result()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.end_flag.set()
+        self.stop_server()
 
-    def _close_connections(self):
-        for connection in self.workers.keys():
-            send(MessageType.end, connection)
-            connection.close()
+    async def _close_connections(self):
+        self.server.close()
+        for writer in list(self.workers):
+            try:
+                await send_async(MessageType.end, writer)
+            except IOError:
+                pass
+            writer.close()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.workers.clear()
+        await self.server.wait_closed()
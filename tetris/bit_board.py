@@ -0,0 +1,74 @@
+import numpy as np
+from .board import Board, _without_rows
+import matplotlib.pyplot as plt
+from .placement import Placement, get_table
+from typing import List
+
+
+class BitBoard(Board):
+    """
+    board which keeps every row as single integer,
+    j-th bit of row is set when column j is filled,
+    row_fill and tetromino numbers are not kept
+    """
+    __slots__ = ('rows',)
+
+    def __init__(self, height=20, width=10):
+        self.height: int = height
+        self.width: int = width
+        self.placements = get_table(width)
+        self.rows: List[int] = [0] * height
+        self.highest_block: List[int] = [0] * width
+        self.holes: List[int] = [0] * width
+        self.counter: int = 0
+        self.clean_lines: int = 0
+        self._summary = None
+
+    @property
+    def full_row(self) -> int:
+        return (1 << self.width) - 1
+
+    @property
+    def cells(self) -> np.ndarray:
+        """return matrix with 1 in filled cells, row 0 is bottom"""
+        return self.get_occupancy().astype(np.int32)
+
+    def get_occupancy(self) -> np.ndarray:
+        """return boolean matrix of filled cells, row 0 is bottom"""
+        rows = np.array(self.rows, dtype=np.int64)[:, None]
+        return (rows >> np.arange(self.width)) & 1 == 1
+
+    def _is_filled(self, row: int, column: int) -> bool:
+        return self.rows[row] >> column & 1 == 1
+
+    def _is_full(self, row: int) -> bool:
+        return self.rows[row] == self.full_row
+
+    def _fills_row(self, placement: Placement, height: int, i: int) -> bool:
+        return self.rows[height - i] | placement.row_masks[i] == self.full_row
+
+    def _put_blocks(self, placement: Placement, height: int):
+        for i, row_mask in enumerate(placement.row_masks):
+            cur_height = height - i
+            assert self.rows[cur_height] & row_mask == 0
+            self.rows[cur_height] |= row_mask
+
+    def __str__(self):
+        ret = ''
+        for row in reversed(self.rows):
+            for j in range(self.width):
+                ret += str(row >> j & 1).zfill(3) + ' '
+            ret += '\n'
+        return ret
+
+    def _remove_rows(self, full_rows: List[int]):
+        self.rows = _without_rows(self.rows, full_rows)
+        self.rows.extend([0] * len(full_rows))
+
+    def plot(self):
+        plt.matshow(self.get_occupancy()[::-1, :])
+        plt.show()
+
+
+if __name__ == "__main__":
+    pass
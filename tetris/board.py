@@ -1,25 +1,55 @@
 import numpy as np
 from .tetromino import Tetromino
+from .placement import Placement, get_table
+from operator import add
 import matplotlib.pyplot as plt
-from typing import List
+from typing import List, Optional, Tuple
+
+
+def _without_rows(rows: List[int], removed: List[int]) -> List[int]:
+    return [value for row, value in enumerate(rows) if row not in removed]
 
 
 class Board:
+    __slots__ = ('height', 'width', 'placements', '_cells', '_row_index',
+                 'highest_block', 'holes', 'row_fill', 'counter',
+                 'clean_lines', '_summary')
+
     def __init__(self, height=20, width=10):
         self.height: int = height
         self.width: int = width
-        self.cells = np.zeros(shape=(height, width), dtype=int)
-        self.highest_block = np.zeros(width, dtype=int)
-        self.holes: List[int] = np.zeros(width, dtype=int)
+        self.placements = get_table(width)
+        # physical rows of cells are reused, _row_index[row] is position
+        # of board row in _cells, so removing row only moves indexes
+        self._cells = np.zeros(shape=(height, width), dtype=np.int32)
+        self._row_index: List[int] = list(range(height))
+        self.highest_block: List[int] = [0] * width
+        self.holes: List[int] = [0] * width
+        self.row_fill: List[int] = [0] * height
         self.counter: int = 0
         self.clean_lines: int = 0
+        self._summary = None
 
     class FullBoardError(Exception):
         pass
 
+    def __getstate__(self):
+        """placement table and cached summary are not pickled"""
+        names = (name for cls in type(self).__mro__
+                 for name in getattr(cls, '__slots__', ()))
+        return {name: getattr(self, name) for name in names
+                if name not in ('placements', '_summary')
+                and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.placements = get_table(self.width)
+        self._summary = None
+
     def get_aggregate_height(self) -> int:
         """return sum of highest block on board"""
-        return sum(self.highest_block)
+        return sum(self._heights())
 
     def get_completed_lines(self) -> int:
         """return number of cleaned lines"""
@@ -31,26 +61,55 @@ class Board:
 
     def get_bumpiness(self) -> int:
         """return sum of height difference from adjacent columns"""
+        heights = self._heights()
         ret = 0
         for i in range(self.width - 1):
-            ret += abs(self.highest_block[i]
-                       - self.highest_block[i + 1])
+            ret += abs(heights[i] - heights[i + 1])
         return ret
 
-    def _fill(self, position, height, shape):
-        for i, row in enumerate(shape):
-            for j, col in enumerate(row):
-                cur_position = position + j
-                cur_height = height - i
-                if col == 'x':
-                    if self.cells[cur_height, cur_position] != 0:
-                        print("stop")
-                    assert self.cells[cur_height, cur_position] == 0
-                    self.cells[cur_height, cur_position] = self.counter
-
-                    self._repair_holes(cur_height + 1, cur_position)
-                    if cur_height + 1 > self.highest_block[cur_position]:
-                        self.highest_block[cur_position] = cur_height + 1
+    @property
+    def cells(self) -> np.ndarray:
+        """return matrix of tetromino numbers, row 0 is bottom"""
+        return self._cells[self._row_index]
+
+    def get_occupancy(self) -> np.ndarray:
+        """return boolean matrix of filled cells, row 0 is bottom"""
+        return self.cells != 0
+
+    def _put_blocks(self, placement: Placement, height: int):
+        for i, position in placement.cells:
+            cur_height = self._row_index[height - i]
+            assert self._cells[cur_height, position] == 0
+            self._cells[cur_height, position] = self.counter
+        for i, blocks in enumerate(placement.row_blocks):
+            self.row_fill[height - i] += blocks
+
+    def _is_filled(self, row: int, column: int) -> bool:
+        return self._cells[self._row_index[row], column] != 0
+
+    def _is_full(self, row: int) -> bool:
+        return self.row_fill[row] == self.width
+
+    def _fills_row(self, placement: Placement, height: int, i: int) -> bool:
+        """test if i-th row of placement put at height fills board row"""
+        return (self.row_fill[height - i] + placement.row_blocks[i]
+                == self.width)
+
+    def _fill(self, placement: Placement, height: int):
+        self._put_blocks(placement, height)
+        for j, bottom in enumerate(placement.bottom):
+            cur_position = placement.position + j
+            self.holes[cur_position] += (height - bottom + 1
+                                         - self.highest_block[cur_position])
+            self.highest_block[cur_position] = height - placement.top[j] + 1
+
+    @staticmethod
+    def _landing_height(placement: Placement, heights) -> int:
+        """return board row of the top row of placed tetromino"""
+        max_height = max(map(add, placement.bottom,
+                             heights[placement.position:
+                                     placement.position + placement.width]))
+        return max_height - 1
 
     def add(self, tetromino: Tetromino, left_position: int):
         """
@@ -59,28 +118,90 @@ class Board:
         be placed on board
         """
         assert left_position >= 0
-        t_width = len(tetromino.get_shape()[0])
-        assert left_position + t_width <= self.width
+        placements = self.placements[tetromino.shape][tetromino.rotation]
+        assert left_position < len(placements)
 
-        lowest_positions = tetromino.get_highest_positions()
-        ran = range(left_position, left_position + t_width)
-        max_height = max(lowest_positions[i] + self.highest_block[pos]
-                         for i, pos in enumerate(ran))
-        max_height -= 1
+        return self.add_placement(placements[left_position])
+
+    def add_placement(self, placement: Placement):
+        """add tetromino described by placement from placement table"""
+        max_height = self._landing_height(placement, self.highest_block)
 
         if max_height >= self.height:
             raise Board.FullBoardError()
 
         self.counter += 1
-        self._fill(left_position, max_height, tetromino.get_shape())
+        self._summary = None
+        self._fill(placement, max_height)
         self._repair_full_rows(max_height)
         return self
 
+    def evaluate(self, tetromino: Tetromino, left_position: int) \
+            -> Optional[Tuple[int, int, int, int]]:
+        """
+        return (aggregate height, cleaned lines, holes, bumpiness) which
+        board would have after adding tetromino, board is not changed,
+        None is returned when board would be full
+        """
+        placements = self.placements[tetromino.shape][tetromino.rotation]
+        return self.evaluate_placement(placements[left_position])
+
+    def evaluate_placement(self, placement: Placement) \
+            -> Optional[Tuple[int, int, int, int]]:
+        """evaluate tetromino described by placement from placement table"""
+        if self._summary is None:
+            self._summary = (self._heights(), self.get_aggregate_height(),
+                             self.get_num_holes(), self.get_bumpiness())
+        heights, height, holes, bumpiness = self._summary
+        max_height = self._landing_height(placement, heights)
+
+        if max_height >= self.height:
+            return None
+
+        full_rows = [max_height - i
+                     for i in range(len(placement.row_blocks))
+                     if self._fills_row(placement, max_height, i)]
+        if full_rows:
+            return self._evaluate_cleared(placement, max_height, full_rows)
+
+        heights = list(heights)
+        left_position = placement.position
+        left = max(left_position - 1, 0)
+        right = min(left_position + placement.width, self.width - 1)
+        for i in range(left, right):
+            bumpiness -= abs(heights[i] - heights[i + 1])
+
+        for j, bottom in enumerate(placement.bottom):
+            cur_position = left_position + j
+            holes += max_height - bottom + 1 - heights[cur_position]
+            height -= heights[cur_position]
+            heights[cur_position] = max_height - placement.top[j] + 1
+            height += heights[cur_position]
+
+        for i in range(left, right):
+            bumpiness += abs(heights[i] - heights[i + 1])
+        return height, 0, holes, bumpiness
+
+    def _evaluate_cleared(self, placement, height, full_rows):
+        occupied = self.get_occupancy().copy()
+        for i, position in placement.cells:
+            occupied[height - i, position] = True
+
+        kept = np.delete(occupied, full_rows, axis=0)
+        heights = np.where(kept.any(axis=0),
+                           len(kept) - np.argmax(kept[::-1], axis=0), 0)
+        aggregate_height = int(heights.sum())
+        holes = aggregate_height - int(np.count_nonzero(kept))
+        bumpiness = int(np.abs(np.diff(heights)).sum())
+        return aggregate_height, len(full_rows), holes, bumpiness
+
+    def _heights(self) -> List[int]:
+        return list(self.highest_block)
+
     def gen_insert_position(self, tetromino: Tetromino):
         """generate all possible positions form concrete tetromino"""
-        tet_width = len(tetromino.get_shape()[0])
-        for start_pos in range(self.width - tet_width + 1):
-            yield start_pos
+        placements = self.placements[tetromino.shape][tetromino.rotation]
+        return iter(range(len(placements)))
 
     def __str__(self):
         ret = ''
@@ -91,39 +212,43 @@ class Board:
         return ret
 
     def _repair_full_rows(self, height):
-        is_full_row = False
-
-        for i in range(4):
-            suspected_row = height - i
-            if (suspected_row >= 0
-                and all(self.cells[suspected_row, j] != 0
-                        for j in range(self.width))):
-                self.cells = np.delete(self.cells, suspected_row, 0)
-                empty = np.zeros(shape=(1, self.width), dtype=int)
-                self.cells = np.append(self.cells, empty, axis=0)
-
-                self.clean_lines += 1
-                is_full_row = True
-
-        if is_full_row:
-            self._repair_highest_block()
-
-    def _repair_holes(self, below_height, position):
-        self.holes[position] = 0
-        for i in range(below_height):
-            if self.cells[i, position] == 0:
-                self.holes[position] += 1
-
-    def _repair_highest_block(self):
-        for i in range(self.width):
-            start_height = self.highest_block[i] - 1
-            for j in range(start_height, -1, -1):
-                if self.cells[j, i] != 0:
-                    self.highest_block[i] = j + 1
-                    break
-            else:
-                self.highest_block[i] = 0
-            self._repair_holes(self.highest_block[i], i)
+        full_rows = [row for row in range(height, max(height - 4, -1), -1)
+                     if self._is_full(row)]
+        if not full_rows:
+            return
+
+        self._repair_columns(full_rows)
+        self._remove_rows(full_rows)
+        self.clean_lines += len(full_rows)
+
+    def _remove_rows(self, full_rows: List[int]):
+        """remove all full rows in one pass, add empty rows on top"""
+        removed = [self._row_index[row] for row in full_rows]
+        self._cells[removed] = 0
+        self._row_index = _without_rows(self._row_index, full_rows)
+        self._row_index.extend(removed)
+        self.row_fill = _without_rows(self.row_fill, full_rows)
+        self.row_fill.extend([0] * len(full_rows))
+
+    def _repair_columns(self, full_rows: List[int]):
+        """
+        update heights and holes before full rows are removed,
+        column is scanned only when its highest block is removed
+        and only down to the next remaining block
+        """
+        for column in range(self.width):
+            row = self.highest_block[column] - 1
+            if row not in full_rows:
+                self.highest_block[column] -= len(full_rows)
+                continue
+
+            while row >= 0 and (row in full_rows
+                                or not self._is_filled(row, column)):
+                if row not in full_rows:
+                    self.holes[column] -= 1
+                row -= 1
+            below = sum(1 for full_row in full_rows if full_row < row)
+            self.highest_block[column] = row + 1 - below
 
     def plot(self):
         plt.matshow(self.cells[::-1, :])
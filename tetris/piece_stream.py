@@ -0,0 +1,37 @@
+import numpy as np
+from .tetromino import Tetromino
+from typing import NamedTuple, Tuple
+
+# tetrominos in sequences are kept as indexes of SHAPES
+SHAPES = tuple(Tetromino.shape)
+
+
+class PieceStream(NamedTuple):
+    """
+    seeded sequences of tetrominos, every game has its own sequence
+    depending only on seed and number of game, so any range of games
+    can be generated independently e.g. by worker
+    """
+    seed: Tuple[int, ...]
+    bag: bool = False  # every 7 tetrominos are permutation of all shapes
+
+    def pieces(self, number_of_games: int, number_of_tetrominos: int,
+               first_game: int = 0) -> np.ndarray:
+        """return (games, tetrominos) uint8 indexes of SHAPES"""
+        pieces = np.empty((number_of_games, number_of_tetrominos),
+                          dtype=np.uint8)
+        for i in range(number_of_games):
+            rng = np.random.default_rng((*self.seed, first_game + i))
+            pieces[i] = self._sequence(rng, number_of_tetrominos)
+        return pieces
+
+    def _sequence(self, rng: np.random.Generator,
+                  number_of_tetrominos: int) -> np.ndarray:
+        if not self.bag:
+            return rng.integers(0, len(SHAPES), number_of_tetrominos,
+                                dtype=np.uint8)
+
+        bags = -(-number_of_tetrominos // len(SHAPES))
+        shapes = np.arange(len(SHAPES), dtype=np.uint8)
+        sequence = rng.permuted(np.tile(shapes, (bags, 1)), axis=1)
+        return sequence.reshape(-1)[:number_of_tetrominos]
@@ -0,0 +1,58 @@
+from .tetromino import Tetromino
+from functools import lru_cache
+from typing import NamedTuple, Tuple, Dict
+
+
+class Placement(NamedTuple):
+    """
+    tetromino in concrete rotation put in concrete board column,
+    rows are counted down from the top row of tetromino,
+    columns are board columns
+    """
+    shape: str
+    rotation: int
+    position: int
+    width: int
+    cells: Tuple[Tuple[int, int], ...]  # (row, column) of every block
+    bottom: Tuple[int, ...]  # 1 + row of lowest block in every column
+    top: Tuple[int, ...]  # row of highest block in every column
+    row_masks: Tuple[int, ...]  # bitmask of every row, bit j is column j
+    row_blocks: Tuple[int, ...]  # number of blocks in every row
+
+
+Table = Dict[str, Tuple[Tuple[Placement, ...], ...]]
+
+
+def _create_placement(shape: str, rotation: int, position: int) -> Placement:
+    rows = Tetromino.shape[shape][rotation]
+    width = len(rows[0])
+    columns = range(width)
+    cells = tuple((i, position + j) for i, row in enumerate(rows)
+                  for j in columns if row[j] == 'x')
+    top = tuple(min(i for i, j in cells if j == position + col)
+                for col in columns)
+    row_masks = tuple(sum(1 << (position + j) for j in columns
+                          if row[j] == 'x') for row in rows)
+
+    return Placement(shape, rotation, position, width, cells,
+                     Tetromino.lowest_position[shape][rotation], top,
+                     row_masks, tuple(row.count('x') for row in rows))
+
+
+@lru_cache(maxsize=None)
+def get_table(board_width: int) -> Table:
+    """
+    return placements for board with given width,
+    table[shape][rotation] is tuple of placements for every left position
+    """
+    table = {}
+    for shape, rotations in Tetromino.shape.items():
+        table[shape] = tuple(
+            tuple(_create_placement(shape, rotation, position)
+                  for position in range(board_width - len(rows[0]) + 1))
+            for rotation, rows in enumerate(rotations)
+        )
+    return table
+
+
+TABLE: Table = get_table(10)
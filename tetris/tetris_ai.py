@@ -1,6 +1,10 @@
 from tetris.board import Board, Tetromino
-from typing import Tuple, NamedTuple, Union
-from copy import deepcopy
+from tetris.bit_board import BitBoard
+from tetris import vectorized
+from tetris.vectorized import get_placement_arrays
+from tetris.placement import Placement
+from typing import Tuple, NamedTuple, Union, Type, Optional
+import numpy as np
 
 
 class Vector(NamedTuple):
@@ -8,9 +12,6 @@ class Vector(NamedTuple):
     lines: int
     holes: int
     bumpiness: int
-    board: Board = None
-    tetromino: Tetromino = None
-    position: int = None
 
 
 class Parameters(NamedTuple):
@@ -25,65 +26,61 @@ class TetrisAI:
         def __init__(self, clean_lines):
             self.clean_lines = clean_lines
 
-    def __init__(self, parameters: Parameters):
+    def __init__(self, parameters: Parameters,
+                 board_type: Type[Board] = BitBoard,
+                 height: int = 20, width: int = 10):
+        """
+        board_type - Board or any drop-in replacement e.g. BitBoard,
+        used by play_game, height and width - size of board
+        """
         self.parameters = parameters
-
-    @staticmethod
-    def _add(board: Board, tetromino: Tetromino, position: int,
-             lines_before: int = 0) -> Vector:
-        """add new tetromino on board and returns information about move"""
-        board = deepcopy(board)
-        try:
-            board.add(tetromino, position)
-        except Board.FullBoardError:
-            return TetrisAI._get_max_vector_x(board)
-
-        height = board.get_aggregate_height()
-        lines = board.get_completed_lines() - lines_before
-        holes = board.get_num_holes()
-        bumpiness = board.get_bumpiness()
-
-        return Vector(height, lines, holes, bumpiness,
-                      board, tetromino, position)
-
-    @staticmethod
-    def _get_max_vector_x(board: Board) -> Vector:
-        big_number = board.height * board.width
-        return Vector(big_number, 0, big_number, big_number)
+        self.board_type = board_type
+        self.height = height
+        self.width = width
+
+    def calc_metric(self, values: Optional[Vector]) -> float:
+        """return score of move, values are None when move fills board"""
+        if not values:
+            return vectorized.FULL_BOARD_METRIC
+        height, lines, holes, bumpiness = values
+        a, b, c, d = self.parameters
+        return height * a + lines * b + holes * c + bumpiness * d
 
     def choose_best_option(self, board: Board, tetromino: Tetromino,
                            ret_pos_and_rot: bool = False) \
-            -> Union[Board, Tuple[int, int]]:
+            -> Union[Board, Tuple[int, int], None]:
         """
         chose next best (board | position and rotation) depending on:
-        current board, new tetromino and ai_parameters
+        current board, new tetromino and ai_parameters,
+        moves are evaluated from heights and holes kept by board,
+        best one is added to given board,
+        None is returned when every move fills board
         """
+        best_metric = vectorized.FULL_BOARD_METRIC
+        best_placement: Optional[Placement] = None
 
-        def calc_metric(values: Vector) -> float:
-            if not values.board:
-                return -100
-            height, lines, holes, bumpiness = values[:4]
-            a, b, c, d = self.parameters
-            return height * a + lines * b + holes * c + bumpiness * d
-
-        completed_lines = board.get_completed_lines()
-        best_result: Vector = TetrisAI._get_max_vector_x(board)
+        arrays = get_placement_arrays(board.width, tetromino.shape,
+                                      tetromino.rotation)
+        for placement in arrays.placements:
+            values = board.evaluate_placement(placement)
+            metric = self.calc_metric(values and Vector(*values))
+            if metric >= best_metric:
+                best_metric = metric
+                best_placement = placement if values else None
 
-        for tetromino in tetromino.gen_rotation():
-            for position in board.gen_insert_position(tetromino):
-                result = self._add(board, tetromino, position, completed_lines)
-                best_result = max((result, best_result), key=calc_metric)
+        if not best_placement:
+            return None
 
         if ret_pos_and_rot:
-            return best_result.position, best_result.tetromino.rotation
-        return best_result.board
+            return best_placement.position, best_placement.rotation
+        return board.add_placement(best_placement)
 
     def play_game(self, number_of_tetrominos: int) -> Tuple[bool, int]:
         """simulate game until tetrominos will be ended or game is over"""
-        board = Board()
+        board = self.board_type(self.height, self.width)
 
         for _ in range(number_of_tetrominos):
-            tetromino = Tetromino()
+            tetromino = Tetromino.get(Tetromino._random())
             best_result = self.choose_best_option(board, tetromino)
             if not best_result:
                 return False, board.clean_lines
@@ -91,6 +88,23 @@ class TetrisAI:
 
         return True, board.clean_lines
 
+    def play_games(self, number_of_games: int, number_of_tetrominos: int,
+                   pieces: np.ndarray = None) -> Tuple[int, int]:
+        """
+        simulate all games in lockstep, boards of all games are kept
+        as one boolean array, so board_type is not used,
+        pieces - (games, tetrominos) sequences e.g. from PieceStream,
+        random sequences are used when not given,
+        return number of won games and sum of clean lines
+        """
+        if pieces is None:
+            pieces = vectorized.random_pieces(number_of_games,
+                                              number_of_tetrominos)
+        assert pieces.shape == (number_of_games, number_of_tetrominos)
+        won, clean_lines = vectorized.play_games(
+            pieces, self.parameters, self.height, self.width)
+        return int(won.sum()), int(clean_lines.sum())
+
 
 if __name__ == "__main__":
     pass
@@ -1,8 +1,28 @@
 from random import choice
-from copy import copy
+from typing import Dict, Tuple
+
+
+class _ShapeAttribute:
+    """
+    Tetromino.shape is dictionary of all shapes,
+    tetromino.shape is symbol of concrete tetromino kept in slot
+    """
+
+    def __init__(self, shapes: Dict[str, Tuple[Tuple[str, ...], ...]]):
+        self.shapes = shapes
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.shapes
+        return instance._shape
+
+    def __set__(self, instance, value: str):
+        instance._shape = value
 
 
 class Tetromino:
+    __slots__ = ('_shape', 'rotation')
+
     shape = {
         'I': (("xxxx",), ("x",) * 4),
         'J': (("xoo",
@@ -38,6 +58,8 @@ class Tetromino:
                                          "xo")),
     }
 
+    shape = _ShapeAttribute(shape)
+
     lowest_position = {
         'I': ((1, 1, 1, 1), (4,)),
         'J': ((2, 2, 2), (3, 1), (1, 1, 2), (3, 3)),
@@ -61,15 +83,16 @@ class Tetromino:
         self.rotation %= len(Tetromino.shape[self.shape])
         return self
 
-    def gen_rotation(self):
-        """generate all possible rotations of tetromino"""
-        duplicated = copy(self)
-        yield duplicated
-        duplicated.next_rotation()
+    @staticmethod
+    def get(shape: str, rotation: int = 0) -> "Tetromino":
+        """return shared tetromino, it can not be rotated"""
+        return _SHARED[shape][rotation]
 
-        while duplicated.rotation != self.rotation:
-            yield duplicated
-            duplicated.next_rotation()
+    def gen_rotation(self):
+        """generate all possible rotations of tetromino as shared objects"""
+        rotations = _SHARED[self.shape]
+        for i in range(len(rotations)):
+            yield rotations[(self.rotation + i) % len(rotations)]
 
     def get_shape(self):
         """return tuple of strings which are tetromino representation"""
@@ -93,3 +116,22 @@ class Tetromino:
     @staticmethod
     def _random():
         return choice(list(Tetromino.shape.keys()))
+
+
+class _SharedTetromino(Tetromino):
+    __slots__ = ()
+
+    def __init__(self, shape: str, rotation: int):
+        super().__init__(shape)
+        self.rotation = rotation
+
+    def next_rotation(self):
+        raise TypeError("shared tetromino can not be rotated")
+
+    def __reduce__(self):
+        return Tetromino.get, (self.shape, self.rotation)
+
+
+_SHARED = {shape: tuple(_SharedTetromino(shape, rotation)
+                        for rotation in range(len(rotations)))
+           for shape, rotations in Tetromino.shape.items()}
@@ -0,0 +1,251 @@
+import numpy as np
+from .placement import Placement, get_table
+from .piece_stream import SHAPES
+from functools import lru_cache
+from random import choices
+from typing import NamedTuple, Tuple
+
+FULL_BOARD_METRIC = -100
+MAX_CELLS = 1 << 24
+
+
+class PlacementArrays(NamedTuple):
+    """all placements of one tetromino in order of evaluation"""
+    placements: Tuple[Placement, ...]
+    rows: np.ndarray  # (K, 4) row of every block, counted down from top
+    columns: np.ndarray  # (K, 4) board column of every block
+
+
+class Features(NamedTuple):
+    """board features after every placement, arrays have shape (N, K)"""
+    height: np.ndarray
+    lines: np.ndarray
+    holes: np.ndarray
+    bumpiness: np.ndarray
+    full: np.ndarray  # True when placement does not fit on board
+
+
+@lru_cache(maxsize=None)
+def get_placement_arrays(board_width: int, shape: str,
+                         first_rotation: int = 0) -> PlacementArrays:
+    """
+    return placements of tetromino for board with given width,
+    rotations are ordered like in Tetromino.gen_rotation
+    """
+    rotations = get_table(board_width)[shape]
+    placements = tuple(placement for i in range(len(rotations))
+                       for placement in rotations[(first_rotation + i)
+                                                  % len(rotations)])
+    cells = np.array([p.cells for p in placements], dtype=np.intp)
+    cells = cells.reshape((len(placements), 4, 2))
+    return PlacementArrays(placements, cells[:, :, 0], cells[:, :, 1])
+
+
+def get_heights(occupied: np.ndarray) -> np.ndarray:
+    """return (N, W) heights of columns of (N, H, W) boards"""
+    height = occupied.shape[-2]
+    top = np.argmax(occupied[..., ::-1, :], axis=-2)
+    return np.where(occupied.any(axis=-2), height - top, 0)
+
+
+def _place(occupied: np.ndarray, rows: np.ndarray, columns: np.ndarray):
+    """
+    return (N, K, H, W) boards with every placement added,
+    (N, K, H) full rows of these boards and (N, K) placements which
+    do not fit on board
+    """
+    n, height, width = occupied.shape
+    rows = np.broadcast_to(rows, (n,) + rows.shape[-2:])
+    columns = np.broadcast_to(columns, rows.shape)
+    k = rows.shape[1]
+
+    heights = get_heights(occupied)
+    landing = np.take_along_axis(heights, columns.reshape(n, -1), axis=1)
+    top = (landing.reshape(rows.shape) + rows).max(axis=2, initial=0)
+    full = top >= height
+    block_rows = np.minimum(top[:, :, None] - rows, height - 1)
+
+    boards = np.repeat(occupied[:, None], k, axis=1)
+    board_id, placement_id = np.indices(rows.shape[:2])
+    boards[board_id[:, :, None], placement_id[:, :, None],
+           block_rows, columns] = True
+    return boards, boards.all(axis=3), full
+
+
+def _features(boards: np.ndarray, full_rows: np.ndarray,
+              full: np.ndarray) -> Features:
+    width = boards.shape[-1]
+    lines = np.count_nonzero(full_rows, axis=2)
+    kept = np.cumsum(~full_rows, axis=2, dtype=np.int16)
+    kept[full_rows] = 0
+    new_heights = np.max(boards * kept[:, :, :, None], axis=2)
+
+    aggregate_height = new_heights.sum(axis=2)
+    blocks = np.count_nonzero(boards, axis=(2, 3)) - lines * width
+    holes = aggregate_height - blocks
+    bumpiness = np.abs(np.diff(new_heights, axis=2)).sum(axis=2)
+    return Features(aggregate_height, lines, holes, bumpiness, full)
+
+
+def evaluate(occupied: np.ndarray, rows: np.ndarray,
+             columns: np.ndarray) -> Features:
+    """
+    calculate features of every placement on every board at once,
+    occupied - (N, H, W) boolean boards, row 0 is bottom,
+    rows, columns - (N, K, 4) or (K, 4) blocks of placements
+    """
+    return _features(*_place(occupied, rows, columns))
+
+
+def calc_metric(features: Features, parameters) -> np.ndarray:
+    """
+    return (N, K) score of every placement,
+    parameters - (4,) common for all boards or (N, 4) for every board
+    """
+    parameters = np.asarray(parameters)
+    a, b, c, d = (parameters[..., i, None] for i in range(4))
+    metric = (features.height * a + features.lines * b
+              + features.holes * c + features.bumpiness * d)
+    return np.where(features.full, FULL_BOARD_METRIC, metric)
+
+
+def choose(features: Features, parameters,
+           valid: np.ndarray = None) -> np.ndarray:
+    """
+    return (N,) index of best placement for every board
+    or -1 when every placement fills board,
+    from equally good placements the last one is chosen,
+    valid - (N, K) mask of placements which should be considered
+    """
+    metric = calc_metric(features, parameters)
+    if metric.shape[1] == 0:
+        return np.full(metric.shape[0], -1)
+    if valid is not None:
+        metric = np.where(valid, metric, -np.inf)
+
+    last = metric.shape[1] - 1
+    best = last - np.argmax(metric[:, ::-1], axis=1)
+    board_id = np.arange(len(best))
+    lost = ((metric[board_id, best] < FULL_BOARD_METRIC)
+            | features.full[board_id, best])
+    return np.where(lost, -1, best)
+
+
+@lru_cache(maxsize=None)
+def get_shape_arrays(board_width: int) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    return (S, K, 4) rows, (S, K, 4) columns and (S, K) valid mask of
+    placements of every shape, index of shape is its index in SHAPES,
+    shapes with less placements are padded with invalid ones
+    """
+    arrays = [get_placement_arrays(board_width, shape) for shape in SHAPES]
+    k = max(len(a.placements) for a in arrays)
+    rows = np.zeros((len(SHAPES), k, 4), dtype=np.intp)
+    columns = np.zeros_like(rows)
+    valid = np.zeros((len(SHAPES), k), dtype=bool)
+    for i, a in enumerate(arrays):
+        size = len(a.placements)
+        rows[i, :size], columns[i, :size] = a.rows, a.columns
+        valid[i, :size] = True
+    return rows, columns, valid
+
+
+def random_pieces(number_of_games: int,
+                  number_of_tetrominos: int) -> np.ndarray:
+    """return (games, tetrominos) random indexes of SHAPES"""
+    pieces = choices(range(len(SHAPES)),
+                     k=number_of_games * number_of_tetrominos)
+    return np.array(pieces, dtype=np.uint8).reshape(
+        (number_of_games, number_of_tetrominos))
+
+
+def play_games(pieces: np.ndarray, parameters, height: int = 20,
+               width: int = 10, max_cells: int = MAX_CELLS) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    simulate many games in lockstep, every step all boards get
+    next tetromino at once,
+    pieces - (N, T) indexes of SHAPES, row is sequence of one game,
+    parameters - (4,) common for all games or (N, 4) for every game,
+    max_cells - limit of cells evaluated in single numpy operation,
+    return (N,) won games and (N,) clean lines
+
+    boards with the same cells and tetromino are evaluated only once,
+    so games with common pieces share most of work
+    """
+    n, number_of_tetrominos = pieces.shape
+    parameters = np.broadcast_to(np.asarray(parameters), (n, 4))
+    rows, columns, valid = get_shape_arrays(width)
+    chunk = max(1, max_cells // (rows.shape[1] * height * width))
+
+    occupied = np.zeros((n, height, width), dtype=bool)
+    alive = np.ones(n, dtype=bool)
+    clean_lines = np.zeros(n, dtype=int)
+
+    for step in range(number_of_tetrominos):
+        game_id = np.flatnonzero(alive)
+        if len(game_id) == 0:
+            break
+
+        boards = occupied[game_id]
+        shapes = pieces[game_id, step]
+        keys = np.packbits(boards.reshape((len(game_id), -1)), axis=1)
+        keys = np.concatenate((keys, shapes[:, None].astype(np.uint8)), 1)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                      return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        for start in range(0, len(first), chunk):
+            unique_id = first[start:start + chunk]
+            members = np.flatnonzero((inverse >= start)
+                                     & (inverse < start + chunk))
+            _play_step(boards[unique_id], shapes[unique_id],
+                       inverse[members] - start, game_id[members],
+                       pieces[game_id[members], step], parameters,
+                       occupied, alive, clean_lines)
+
+    return alive, clean_lines
+
+
+def _play_step(unique_boards, unique_shapes, local_id, game_id, shapes,
+               parameters, occupied, alive, clean_lines):
+    """add next tetromino to games which share evaluated unique boards"""
+    rows, columns, valid = get_shape_arrays(unique_boards.shape[2])
+    height = unique_boards.shape[1]
+    boards, full_rows, full = _place(unique_boards, rows[unique_shapes],
+                                     columns[unique_shapes])
+    features = Features(*(f[local_id] for f in
+                          _features(boards, full_rows, full)))
+    best = choose(features, parameters[game_id], valid[shapes])
+
+    lost = best < 0
+    alive[game_id[lost]] = False
+    game_id, local_id, best = game_id[~lost], local_id[~lost], best[~lost]
+
+    chosen = boards[local_id, best]
+    chosen_full = full_rows[local_id, best]
+    lines = np.count_nonzero(chosen_full, axis=1)
+    order = np.argsort(chosen_full, axis=1, kind='stable')
+    chosen = np.take_along_axis(chosen, order[:, :, None], axis=1)
+    chosen[np.arange(height) >= height - lines[:, None]] = False
+
+    occupied[game_id] = chosen
+    clean_lines[game_id] += lines
+
+
+def play_population(parameters: np.ndarray, pieces: np.ndarray,
+                    height: int = 20, width: int = 10) \
+        -> Tuple[np.ndarray, np.ndarray]:
+    """
+    simulate the same games for many parameters at once,
+    parameters - (M, 4) parameters of every candidate,
+    pieces - (G, T) indexes of SHAPES common for all candidates,
+    return (M,) won games and (M,) sum of clean lines
+    """
+    m, games = len(parameters), len(pieces)
+    won, clean_lines = play_games(np.tile(pieces, (m, 1)),
+                                  np.repeat(parameters, games, axis=0),
+                                  height, width)
+    return (won.reshape((m, games)).sum(axis=1),
+            clean_lines.reshape((m, games)).sum(axis=1))
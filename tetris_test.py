@@ -1,11 +1,38 @@
+import pickle
+import random
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
+import uuid
+import numpy as np
+from copy import deepcopy
 from tetris.board import Board
+from tetris.bit_board import BitBoard
 from tetris.tetromino import Tetromino
+from tetris.placement import TABLE
+from tetris.piece_stream import PieceStream
+from tetris import vectorized
+from tetris.vectorized import get_placement_arrays, SHAPES
 from tetris.tetris_ai import TetrisAI, Parameters
-from candidate import Candidate, Fitness
+from candidate import Candidate, Fitness, Racing
 from genetic_algorithm import GeneticAlgorithm, DEFAULT_HOST, DEFAULT_PORT
 from python_socket_client_server import client
+from python_socket_client_server.server import Server
+from python_socket_client_server.connection import ComputeError, \
+    MessageType, send, send_batch, receive, choose_compression, HEADER, ZLIB
 from multiprocessing import Process
+from concurrent.futures import ThreadPoolExecutor
+from multiprocess import WorkerPool
+from fitness_cache import FitnessCache
+from candidate_store import CandidateStore, COMPACT_FACTOR, RECORD
+from population import population_arrays, normalize, fitness_order, \
+    tournament, crossover, mutate
+from multiprocess_map import fit_job, fit_candidates, pack_job, \
+    worker_pool
 
 
 class TetrominoTest(unittest.TestCase):
@@ -52,17 +79,66 @@ class TetrominoTest(unittest.TestCase):
             t2.next_rotation()
             self.assertEqual(t1, t2)
 
+    def test_shared(self):
+        """rotations are shared objects which can not be rotated"""
+        rotations = list(Tetromino("T").next_rotation().gen_rotation())
+        self.assertEqual([t.rotation for t in rotations], [1, 2, 3, 0])
+        self.assertIs(rotations[0], Tetromino.get("T", 1))
+        self.assertIs(pickle.loads(pickle.dumps(rotations[0])), rotations[0])
+        with self.assertRaises(TypeError):
+            rotations[0].next_rotation()
+
+    def test_placement_table(self):
+        """precomputed placements describe tetromino shapes"""
+        for symbol in self.all_tetrominos:
+            for t in Tetromino(symbol).gen_rotation():
+                shape = t.get_shape()
+                placements = TABLE[symbol][t.rotation]
+                self.assertEqual(len(placements), 11 - len(shape[0]))
+
+                for position, placement in enumerate(placements):
+                    self.assertEqual(placement.position, position)
+                    self.assertEqual(placement.bottom,
+                                     t.get_highest_positions())
+                    blocks = {(i, position + j)
+                              for i, row in enumerate(shape)
+                              for j, col in enumerate(row) if col == 'x'}
+                    self.assertEqual(set(placement.cells), blocks)
+
+
+class PieceStreamTest(unittest.TestCase):
+    def test_seed(self):
+        """the same seed and game give the same sequence"""
+        stream = PieceStream((1, 2))
+        pieces = stream.pieces(5, 50)
+        self.assertEqual(pieces.dtype, np.uint8)
+        self.assertEqual(pieces.shape, (5, 50))
+        np.testing.assert_array_equal(pieces,
+                                      PieceStream((1, 2)).pieces(5, 50))
+        np.testing.assert_array_equal(pieces[2:], stream.pieces(3, 50, 2))
+        self.assertFalse((pieces == PieceStream((1, 3)).pieces(5, 50)).all())
+
+    def test_bag(self):
+        """in bag mode every 7 tetrominos contain all shapes"""
+        pieces = PieceStream((4,), bag=True).pieces(3, 71)
+        for sequence in pieces:
+            for start in range(0, 70, 7):
+                self.assertEqual(sorted(sequence[start:start + 7]),
+                                 list(range(7)))
+
 
 class BoardTests(unittest.TestCase):
+    board_type = Board
+
     def test_add(self):
         """test exception if board is full"""
-        board = Board(10, 3)
+        board = self.board_type(10, 3)
         t = Tetromino("O")
 
         for i in range(5):
             board.add(t, 0)
 
-        with self.assertRaises(Board.FullBoardError):
+        with self.assertRaises(self.board_type.FullBoardError):
             board.add(t, 0)
 
     def test_gen_position(self):
@@ -70,16 +146,16 @@ class BoardTests(unittest.TestCase):
         t1 = Tetromino("O")
         t2 = Tetromino("I")
         for i in (1, 2, 3, 5, 10, 20, 50):
-            pos = list(Board(10, i).gen_insert_position(t1))
+            pos = list(self.board_type(10, i).gen_insert_position(t1))
             self.assertEqual(pos, list(range(i - 1)))
 
-            pos = list(Board(10, i).gen_insert_position(t2))
+            pos = list(self.board_type(10, i).gen_insert_position(t2))
             self.assertEqual(pos, list(range(i - 3)))
 
     def test_clean(self):
         """test remove blocks from board"""
         t = Tetromino("I")
-        b = Board(10, 4)
+        b = self.board_type(10, 4)
 
         for i in range(12):
             b.add(t, 0)
@@ -88,30 +164,41 @@ class BoardTests(unittest.TestCase):
             self.assertEqual(b.highest_block[2], 0)
             self.assertEqual(b.highest_block[3], 0)
 
+    def test_multi_line_clean(self):
+        """test remove many rows at once, rows above are moved down"""
+        b = self.board_type(8, 3)
+        t = Tetromino("I").next_rotation()
+        b.add(t, 0).add(t, 0).add(t, 1).add(t, 2)
+
+        self.assertEqual(b.get_completed_lines(), 4)
+        self.assertEqual(list(b.highest_block), [4, 0, 0])
+        expected = [[True, False, False]] * 4 + [[False] * 3] * 4
+        self.assertEqual(b.get_occupancy().tolist(), expected)
+
     def test_height(self):
         """test sum of all heights"""
-        b = Board()
+        b = self.board_type()
         b.add(Tetromino("T"), 0)
         self.assertEqual(b.get_aggregate_height(), 6)
 
-        b = Board()
+        b = self.board_type()
         t = Tetromino("T").next_rotation()
         self.assertEqual(b.add(t, 0).get_aggregate_height(), 5)
 
-        b = Board()
+        b = self.board_type()
         t = Tetromino("I").next_rotation()
         for i in range(1, 6):
             b.add(t, 0)
             self.assertEqual(b.get_aggregate_height(), 4 * i)
 
-        b = Board(10, 4)
+        b = self.board_type(10, 4)
         self.assertEqual(b.add(Tetromino("S"), 0).get_aggregate_height(), 5)
         self.assertEqual(b.add(t, 3).get_aggregate_height(), 9)
         t = Tetromino("L").next_rotation().next_rotation()
         self.assertEqual(b.add(t, 0).get_aggregate_height(), 4)
         self.assertEqual(b.add(Tetromino("I"), 0).get_aggregate_height(), 4)
 
-        b = Board(20, 3)
+        b = self.board_type(20, 3)
         t = Tetromino("I").next_rotation()
         self.assertEqual(b.add(t, 0).get_aggregate_height(), 4)
         self.assertEqual(b.add(t, 0).get_aggregate_height(), 8)
@@ -121,7 +208,7 @@ class BoardTests(unittest.TestCase):
         """test completed lines counter"""
         t1 = Tetromino("I")
         t2 = Tetromino("O")
-        b = Board(10, 4)
+        b = self.board_type(10, 4)
 
         self.assertEqual(b.add(t1, 0).get_completed_lines(), 1)
         self.assertEqual(b.add(t2, 0).get_completed_lines(), 1)
@@ -132,14 +219,14 @@ class BoardTests(unittest.TestCase):
     def test_holes(self):
         """test sum of unfilled places for block"""
         t = Tetromino("Z")
-        b = Board(10, 6)
+        b = self.board_type(10, 6)
 
         self.assertEqual(b.add(t, 0).get_num_holes(), 1)
         self.assertEqual(b.add(t, 0).get_num_holes(), 3)
         t.next_rotation()
         self.assertEqual(b.add(t, 3).get_num_holes(), 4)
 
-        b = Board(10, 5)
+        b = self.board_type(10, 5)
         t1 = Tetromino("O")
         t2 = Tetromino("I")
 
@@ -151,18 +238,96 @@ class BoardTests(unittest.TestCase):
     def test_bumpiness(self):
         """test height difference in connected columns"""
         t = Tetromino("I").next_rotation()
-        b = Board(10, 4)
+        b = self.board_type(10, 4)
 
         self.assertEqual(b.add(t, 0).get_bumpiness(), 4)
         self.assertEqual(b.add(t, 2).get_bumpiness(), 12)
         self.assertEqual(b.add(t, 1).get_bumpiness(), 4)
         self.assertEqual(b.add(t, 3).get_bumpiness(), 0)
 
+    def test_evaluate(self):
+        """evaluated move has the same features as added tetromino"""
+        random.seed(3)
+        b = self.board_type(10, 6)
+        for _ in range(100):
+            for t in Tetromino().gen_rotation():
+                for position in b.gen_insert_position(t):
+                    copied = deepcopy(b)
+                    try:
+                        copied.add(t, position)
+                    except Board.FullBoardError:
+                        self.assertIsNone(b.evaluate(t, position))
+                        continue
+                    lines = copied.clean_lines - b.clean_lines
+                    expected = (copied.get_aggregate_height(), lines,
+                                copied.get_num_holes(),
+                                copied.get_bumpiness())
+                    self.assertEqual(b.evaluate(t, position), expected)
+            t = Tetromino()
+            try:
+                b.add(t, random.choice(list(b.gen_insert_position(t))))
+            except Board.FullBoardError:
+                b = self.board_type(10, 6)
+
+    def test_incremental_state(self):
+        """heights, holes and full rows are the same as from all cells"""
+        random.seed(11)
+        b = self.board_type(30, 8)
+        for _ in range(300):
+            t = Tetromino()
+            try:
+                b.add(t, random.choice(list(b.gen_insert_position(t))))
+            except Board.FullBoardError:
+                b = self.board_type(30, 8)
+
+            occupied = b.get_occupancy()
+            heights = vectorized.get_heights(occupied)
+            self.assertEqual(list(b.highest_block), heights.tolist())
+            holes = heights - occupied.sum(axis=0)
+            self.assertEqual(list(b.holes), holes.tolist())
+            self.assertEqual([b._is_full(row) for row in range(b.height)],
+                             occupied.all(axis=1).tolist())
+
+    def test_vectorized_evaluate(self):
+        """all placements evaluated at once like one by one"""
+        random.seed(5)
+        b = self.board_type(10, 6)
+        for _ in range(100):
+            t = Tetromino()
+            arrays = get_placement_arrays(b.width, t.shape)
+            features = vectorized.evaluate(b.get_occupancy()[None],
+                                           arrays.rows, arrays.columns)
+
+            for k, placement in enumerate(arrays.placements):
+                values = b.evaluate_placement(placement)
+                self.assertEqual(features.full[0, k], values is None)
+                if values:
+                    self.assertEqual(values, tuple(f[0, k] for f
+                                                   in features[:4]))
+            try:
+                b.add(t, random.choice(list(b.gen_insert_position(t))))
+            except Board.FullBoardError:
+                b = self.board_type(10, 6)
+
+
+    def test_cells(self):
+        b = self.board_type(6, 4)
+        b.add(Tetromino("O"), 1)
+        self.assertEqual(b.cells.shape, (6, 4))
+        self.assertEqual((b.cells != 0).tolist(), b.get_occupancy().tolist())
+        self.assertEqual(np.count_nonzero(b.cells[:2, 1:3]), 4)
+
+
+class BitBoardTests(BoardTests):
+    board_type = BitBoard
+
 
 class TetrisAITest(unittest.TestCase):
+    board_type = Board
+
     def test_height(self):
         """ai want to have height column"""
-        b = Board(20, 2)
+        b = self.board_type(20, 2)
         t = Tetromino("I").next_rotation()
         ai = TetrisAI(Parameters(1, 0, 0, 0))
 
@@ -186,7 +351,7 @@ class TetrisAITest(unittest.TestCase):
         test 5 "I" tetrominos on board with width equal to 5
          -> should be 4 cleaned lines
         """
-        b = Board(20, 5)
+        b = self.board_type(20, 5)
         t = Tetromino("I")
         ai = TetrisAI(Parameters(0, 1, 0, 0))
 
@@ -208,7 +373,7 @@ class TetrisAITest(unittest.TestCase):
         oooo1
         oooo1
         """
-        b = Board(20, 5)
+        b = self.board_type(20, 5)
         t = Tetromino("I")
         ai = TetrisAI(Parameters(0, 0, 1, 0))
 
@@ -222,7 +387,7 @@ class TetrisAITest(unittest.TestCase):
 
     def test_bumpiness(self):
         """ai want to have maximal number of bumpiness"""
-        b = Board(5, 7)
+        b = self.board_type(5, 7)
         t = Tetromino("I")
         ai = TetrisAI(Parameters(0, 0, 0, 1))
 
@@ -234,6 +399,51 @@ class TetrisAITest(unittest.TestCase):
         self.assertEqual(b.get_bumpiness(), 24)
         self.assertEqual(b.get_completed_lines(), 0)
 
+    def test_position_and_rotation(self):
+        """returned move is the one which would be added to board"""
+        b = self.board_type(20, 5)
+        ai = TetrisAI(Parameters(1, 0, 0, 0))
+        t = Tetromino("I")
+
+        position, rotation = ai.choose_best_option(b, t, True)
+        self.assertEqual((position, rotation), (4, 1))
+        self.assertEqual(b.get_aggregate_height(), 0)
+
+    def test_board_types(self):
+        """every board type should play exactly the same game"""
+        ai = TetrisAI(Parameters(-0.5, 0.7, -0.3, -0.2), self.board_type)
+        random.seed(7)
+        result = ai.play_game(60)
+        random.seed(7)
+        self.assertEqual(TetrisAI(ai.parameters, Board).play_game(60), result)
+
+    def test_play_games(self):
+        """games played in lockstep are the same as played one by one"""
+        ai = TetrisAI(Parameters(-0.51, 0.76, -0.36, -0.18), self.board_type)
+        pieces = np.random.default_rng(0).integers(0, 7, (6, 80))
+        won, lines = vectorized.play_games(pieces, ai.parameters)
+
+        for game, sequence in enumerate(pieces):
+            b = self.board_type()
+            for code in sequence:
+                if not ai.choose_best_option(b, Tetromino(SHAPES[code])):
+                    self.assertFalse(won[game])
+                    break
+            else:
+                self.assertTrue(won[game])
+            self.assertEqual(lines[game], b.clean_lines)
+
+        with self.assertRaises(AssertionError):
+            ai.play_games(5, 80, pieces)
+
+        pieces = np.random.default_rng(1).integers(0, 7, (6, 200))
+        won, lines = vectorized.play_games(pieces, Parameters(1, 0, 0, 0))
+        self.assertFalse(won.any())
+
+
+class BitBoardAITest(TetrisAITest):
+    board_type = BitBoard
+
 
 class CandidateTest(unittest.TestCase):
     def test_normalize(self):
@@ -245,6 +455,19 @@ class CandidateTest(unittest.TestCase):
         for a, b in zip(p_n, Parameters(1, 0, 0, 0)):
             self.assertAlmostEqual(a, b)
 
+    def test_pickle(self):
+        """candidates are restored from new and old pickles"""
+        c = Candidate(Parameters(2, 9, 12, -4), Fitness(3, 10))
+        restored = pickle.loads(pickle.dumps(c))
+        self.assertEqual(restored.parameters, c.parameters)
+        self.assertEqual(restored.fitness, c.fitness)
+        self.assertEqual(restored.get_name(), c.get_name())
+
+        old = Candidate.__new__(Candidate)
+        old.__setstate__({"parameters": c.parameters, "fitness": c.fitness,
+                          "id": uuid.UUID(int=c.id), "auto_save": False})
+        self.assertEqual(old.get_name(), c.get_name())
+
     def test_crossover(self):
         parent1 = Candidate(Parameters(2, 9, 12, -4), Fitness(0, 10))
         parent2 = Candidate(Parameters(4, 2, 9, 12), Fitness(0, 10))
@@ -268,6 +491,210 @@ class CandidateTest(unittest.TestCase):
         c.fit(7, 4)
         self.assertEqual(c.fitness.won_games, 7)
 
+    def test_fit_stream(self):
+        """candidates fitted on the same stream play the same games"""
+        stream = PieceStream((5, 0))
+        a = Candidate(Parameters(-0.5, 0.7, -0.3, -0.2)).fit(3, 80, stream)
+        b = Candidate(Parameters(-0.5, 0.7, -0.3, -0.2)).fit(3, 80, stream)
+        self.assertEqual(a.fitness, b.fitness)
+        Candidate.fit_all([b], 3, 80, stream)
+        self.assertEqual(a.fitness, b.fitness)
+
+    def test_fit_all(self):
+        """candidates fitted together play the same games"""
+        candidates = [Candidate(Parameters(-1, 1, -1, -1)),
+                      Candidate(Parameters(-1, 1, -1, -1)),
+                      Candidate(Parameters(1, 0, 1, 1))]
+        Candidate.fit_all(candidates, 4, 60)
+
+        self.assertEqual(candidates[0].fitness, candidates[1].fitness)
+        self.assertEqual(candidates[0].fitness.won_games, 4)
+        self.assertEqual(candidates[2].fitness.won_games, 0)
+
+    def test_racing(self):
+        """losing candidates stop when threshold can not be reached"""
+        stream = PieceStream((5, 0))
+        losing = Candidate(Parameters(1, 0, 1, 1))
+        losing.fit(30, 60, stream, Racing(Fitness(25, 0)))
+        self.assertLess(losing.games_played, 30)
+        self.assertLess(losing.fitness.won_games, 25)
+        self.assertTrue(losing.eliminated)
+
+        winning = Candidate(Parameters(-1, 1, -1, -1))
+        Candidate.fit_all([winning, losing], 30, 60, stream,
+                          Racing(Fitness(0, 0)))
+        self.assertEqual(winning.games_played, 30)
+        self.assertEqual(losing.games_played, 30)
+        self.assertEqual(winning.fitness.won_games, 30)
+        self.assertFalse(losing.eliminated)
+
+    def test_racing_confidence(self):
+        racing = Racing(Fitness(90, 0), confidence=0.95)
+        self.assertFalse(Racing(Fitness(90, 0)).is_settled(2, 10, 100))
+        self.assertTrue(racing.is_settled(2, 10, 100))
+        self.assertFalse(racing.is_settled(9, 10, 100))
+
+    def test_play_population(self):
+        """population simulation is the same as simulation of every one"""
+        parameters = np.array([c.parameters for c in
+                               (Candidate() for _ in range(5))])
+        pieces = vectorized.random_pieces(4, 120)
+        won, lines = vectorized.play_population(parameters, pieces)
+
+        for p, w, l in zip(parameters, won, lines):
+            expected_won, expected_lines = vectorized.play_games(pieces, p)
+            self.assertEqual(w, expected_won.sum())
+            self.assertEqual(l, expected_lines.sum())
+
+
+class ConnectionTest(unittest.TestCase):
+    def test_frames(self):
+        """batched and compressed messages are received one by one"""
+        large = list(range(100000))
+        a, b = socket.socketpair()
+        with a, b:
+            for compression in (None, 'zlib', 'lzma'):
+                sender = threading.Thread(target=send_batch, args=(
+                    [MessageType.compute, large, None], a, compression))
+                sender.start()
+                self.assertEqual(receive(b), MessageType.compute)
+                self.assertEqual(receive(b), large)
+                self.assertIsNone(receive(b))
+                sender.join()
+
+            send(b'x' * 10000, a, 'zlib')
+            length, flags = HEADER.unpack(b.recv(HEADER.size))
+            self.assertLess(length, 10000)
+            self.assertEqual(flags, ZLIB)
+
+    def test_choose_compression(self):
+        self.assertEqual(choose_compression(('brotli', 'lzma')), 'lzma')
+        self.assertIsNone(choose_compression(('brotli',)))
+        self.assertIsNone(choose_compression(None))
+
+
+class ServerTest(unittest.TestCase):
+    port = DEFAULT_PORT + 1
+
+    def client_work(self):
+        client.Client(DEFAULT_HOST, self.port).start_client()
+
+    def test_credits(self):
+        """more items than credits of worker are computed one by one"""
+        items = 3 * client.DECLARED_WORK * client.CREDITS
+        jobs = [pack_job(Candidate().parameters, 0, 1, 5, PieceStream((i,)))
+                for i in range(items)]
+        with Server(DEFAULT_HOST, self.port, GeneticAlgorithm.REQUIRED_DIR,
+                    GeneticAlgorithm.REQUIRED_FILES) as server:
+            server.start_server()
+            p = Process(target=self.client_work, name="client")
+            p.start()
+            records = server.send_data_to_compute(jobs, "multiprocess_map",
+                                                  "fit_job")
+            self.assertEqual([r[:3] for r in records],
+                             [fit_job(job)[:3] for job in jobs])
+
+            with self.assertRaises(ComputeError):
+                server.send_data_to_compute([None], "multiprocess_map",
+                                            "fit_job")
+        p.join()
+
+    def test_submit(self):
+        """submitted items are returned as soon as they are computed"""
+        jobs = [pack_job(Candidate().parameters, 0, 1, 5, PieceStream((i,)))
+                for i in range(3)]
+        with Server(DEFAULT_HOST, self.port, GeneticAlgorithm.REQUIRED_DIR,
+                    GeneticAlgorithm.REQUIRED_FILES) as server:
+            server.start_server()
+            p = Process(target=self.client_work, name="client")
+            p.start()
+            for i, job in enumerate(jobs):
+                server.submit(i, job, "multiprocess_map", "fit_job")
+            results = dict(server.result() for _ in jobs)
+
+            self.assertEqual({i: r[:3] for i, r in results.items()},
+                             {i: fit_job(j)[:3] for i, j in enumerate(jobs)})
+        p.join()
+
+    def test_concurrent_computations(self):
+        """items of computations sent at once are not mixed in batches"""
+        jobs = [pack_job(Candidate().parameters, 0, 1, 5, PieceStream((i,)))
+                for i in range(client.DECLARED_WORK)]
+        with Server(DEFAULT_HOST, self.port, GeneticAlgorithm.REQUIRED_DIR,
+                    GeneticAlgorithm.REQUIRED_FILES) as server, \
+                ThreadPoolExecutor(2) as executor:
+            server.start_server()
+            p = Process(target=self.client_work, name="client")
+            p.start()
+            records = executor.submit(server.send_data_to_compute, jobs,
+                                      "multiprocess_map", "fit_job")
+            arrays = executor.submit(server.send_data_to_compute,
+                                     [10] * len(jobs), "tetris.vectorized",
+                                     "get_shape_arrays")
+
+            self.assertEqual([r[:3] for r in records.result()],
+                             [fit_job(job)[:3] for job in jobs])
+            for rows, _columns, _valid in arrays.result():
+                np.testing.assert_array_equal(
+                    rows, vectorized.get_shape_arrays(10)[0])
+        p.join()
+
+    def test_files(self):
+        """worker downloads only files missing in its cache"""
+        with Server(DEFAULT_HOST, self.port, [], ["candidate.py"]) as server, \
+                socket.create_connection((DEFAULT_HOST, self.port)) as sock:
+            server.start_server()
+            _dirs, [(name, digest)] = receive(sock)
+            with open(name, 'rb') as file:
+                data = file.read()
+            self.assertEqual(hashlib.sha256(data).hexdigest(), digest)
+            send_batch([MessageType.download, [digest]], sock)
+            self.assertEqual(receive(sock), {digest: data})
+
+        with tempfile.TemporaryDirectory() as directory:
+            c = client.Client.__new__(client.Client)
+            c.directory = directory + "/"
+            new = hashlib.sha256(b"new").hexdigest()
+            os.makedirs(c.directory + client.CACHE)
+            with open(c._cached(new), 'wb') as file:
+                file.write(b"new")
+            with open(c.directory + "a.py", 'wb') as file:
+                file.write(b"old")
+
+            manifest = ["tetris/"], [("a.py", new), ("tetris/b.py", new)]
+            self.assertEqual(c._missing_files(manifest), [])
+            self.assertEqual(c._missing_files(([], [("a.py", "x")])), ["x"])
+            c._install_files(manifest)
+            for name in ("a.py", "tetris/b.py"):
+                with open(c.directory + name, 'rb') as file:
+                    self.assertEqual(file.read(), b"new")
+
+    def test_straggler(self):
+        """items of worker which does not answer are computed by other"""
+        jobs = [pack_job(Candidate().parameters, 0, 1, 5, PieceStream((i,)))
+                for i in range(4)]
+        with Server(DEFAULT_HOST, self.port, GeneticAlgorithm.REQUIRED_DIR,
+                    GeneticAlgorithm.REQUIRED_FILES,
+                    lease_seconds=0.5) as server, \
+                socket.create_connection((DEFAULT_HOST, self.port)) as sock, \
+                ThreadPoolExecutor(1) as executor:
+            server.start_server()
+            receive(sock)
+            send(MessageType.get_work, sock)
+            send((1, 1), sock)
+            time.sleep(0.2)
+
+            records = executor.submit(server.send_data_to_compute, jobs,
+                                      "multiprocess_map", "fit_job")
+            self.assertEqual(receive(sock), MessageType.compute)
+            self.assertEqual(len(receive(sock)), 1)
+            p = Process(target=self.client_work, name="client")
+            p.start()
+
+            self.assertEqual([r[:3] for r in records.result()],
+                             [fit_job(job)[:3] for job in jobs])
+        p.join()
+
 
 class GeneticAlgorithmTest(unittest.TestCase):
     def test_generate_population(self):
@@ -301,6 +728,265 @@ class GeneticAlgorithmTest(unittest.TestCase):
 
         p.join()
 
+    def test_worker_pool(self):
+        """the same workers fit candidates of every generation"""
+        with GeneticAlgorithm(10, offsprings_num=1, fit_type="multi",
+                              parents_num_in_tournament=1,
+                              games_number=2, load_files=False,
+                              tetrominos_in_single_game=5) as ga:
+            ga._fit_all([Candidate() for _ in range(3)])
+            processes = ga.pool.processes
+            candidates = ga._fit_all([Candidate() for _ in range(3)])
+            self.assertIs(ga.pool.processes, processes)
+            self.assertTrue(all(p.is_alive() for p in processes))
+            self.assertTrue(all(c.fitness for c in candidates))
+
+        self.assertIsNone(ga.pool)
+        self.assertFalse(any(p.is_alive() for p in processes))
+
+    def test_fit_chunks(self):
+        """candidates fitted by chunks of games play all their games"""
+        stream = PieceStream((3, 1))
+        candidates = [Candidate() for _ in range(4)]
+        expected = [Candidate(c.parameters).fit(9, 40, stream)
+                    for c in candidates]
+        with WorkerPool(fit_job, 2) as pool:
+            fit_candidates(pool, candidates, 9, 40, stream)
+
+        for c, e in zip(candidates, expected):
+            self.assertEqual(c.fitness, e.fitness)
+            self.assertEqual(c.games_played, 9)
+
+    def test_fit_shared(self):
+        """shared memory fit gives the same fitness as fit by jobs"""
+        stream = PieceStream((3, 2))
+        candidates = [Candidate() for _ in range(3)]
+        expected = [Candidate(c.parameters).fit(6, 40, stream)
+                    for c in candidates]
+        with worker_pool(shared=True) as pool:
+            fit_candidates(pool, candidates, 6, 40, stream, shared=True)
+            fit_candidates(pool, candidates[:1], 6, 40, stream, shared=True)
+
+        for c, e in zip(candidates, expected):
+            self.assertEqual(c.fitness, e.fitness)
+            self.assertEqual(c.games_played, 6)
+
+    def test_job(self):
+        """jobs sent to workers are small and give the same fitness"""
+        stream = PieceStream((3, 1))
+        c = Candidate()
+        job = pack_job(c.parameters, 2, 5, 40, stream)
+        self.assertLess(len(pickle.dumps(job)), 100)
+
+        won, lines, played, _seconds = fit_job(job)
+        expected = Candidate(c.parameters).fit(7, 40, stream)
+        first = Candidate(c.parameters).fit(2, 40, stream)
+        self.assertEqual(played, 5)
+        self.assertEqual(won + first.fitness.won_games,
+                         expected.fitness.won_games)
+        self.assertEqual(lines + first.fitness.clean_lines,
+                         expected.fitness.clean_lines)
+
+    def test_compare_old_algorithm(self):
+        """algorithm saved before new settings existed is still valid"""
+        old = GeneticAlgorithm.__new__(GeneticAlgorithm)
+        old.__dict__.update(population=None, offsprings=None,
+                            num_of_population=10, games_number=3,
+                            tetrominos_in_single_game=5,
+                            parents_num_in_tournament=1, offsprings_num=1,
+                            mutation_chance=0.05, mutation_max_value=0.2,
+                            load_files=True)
+        with GeneticAlgorithm(10, offsprings_num=1, fit_type="single",
+                              parents_num_in_tournament=1,
+                              games_number=3, load_files=False,
+                              tetrominos_in_single_game=5) as ga:
+            self.assertEqual(old, ga)
+            self.assertEqual(pickle.loads(pickle.dumps(ga)), old)
+            ga.seed = 4
+            self.assertNotEqual(old, ga)
+
+    def test_select_survivors(self):
+        """offspring eliminated by racing do not replace candidates"""
+        with GeneticAlgorithm(4, offsprings_num=2,
+                              parents_num_in_tournament=1,
+                              games_number=3, load_files=False,
+                              tetrominos_in_single_game=5) as ga:
+            ga.population = [Candidate().set_fitness(w, 0, 3, 3)
+                             for w in range(4)]
+            ga.offsprings = [Candidate().set_fitness(3, 0, 3, 3),
+                             Candidate().set_fitness(0, 0, 1, 3)]
+            kept = sorted(ga.population, reverse=True)[:3]
+            ga._select_survivors()
+
+            self.assertEqual(len(ga.population), 4)
+            self.assertFalse(any(c.eliminated for c in ga.population))
+            self.assertEqual(ga.population[:3], kept)
+
+    def test_fitness_cache(self):
+        """parameters are fitted once for seeded games, also by new run"""
+        parameters = Candidate().parameters
+        with tempfile.TemporaryDirectory() as directory:
+            for run in range(2):
+                with GeneticAlgorithm(10, offsprings_num=1, fit_type="single",
+                                      parents_num_in_tournament=1,
+                                      games_number=3, load_files=False,
+                                      tetrominos_in_single_game=20, seed=7,
+                                      cache_size=10,
+                                      cache_file=directory + "/cache") as ga:
+                    candidates = ga._fit_all([Candidate(parameters),
+                                              Candidate(parameters)])
+                    self.assertEqual(ga.cache.hits, 2 * run)
+                    self.assertEqual(len(ga.cache), 1)
+
+                expected = Candidate(parameters).fit(3, 20, ga._piece_stream())
+                for c in candidates:
+                    self.assertEqual(c.fitness, expected.fitness)
+
+        cache = FitnessCache(2)
+        for i in range(3):
+            cache.put(i, Fitness(i, 0))
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(2), Fitness(2, 0))
+
+    def test_candidate_store(self):
+        """store returns living candidates and is compacted"""
+        with tempfile.TemporaryDirectory() as directory:
+            filename = directory + "/store"
+            store = CandidateStore(filename)
+            candidates = [Candidate().set_fitness(i, i, 1, 1)
+                          for i in range(3)]
+            store.add(candidates, 0)
+            store.flush()
+            store.remove(candidates[:1], 1)
+            store.flush()
+
+            loaded = CandidateStore(filename).load()
+            for c, expected in zip(loaded, candidates[1:], strict=True):
+                self.assertEqual(c.id, expected.id)
+                self.assertEqual(c.parameters, expected.parameters)
+                self.assertEqual(c.fitness, expected.fitness)
+
+            for _ in range(2 * COMPACT_FACTOR):
+                store.remove(candidates[1:2], 2)
+                store.add(candidates[1:2], 2)
+                store.flush()
+            self.assertLessEqual(os.path.getsize(filename),
+                                 2 * COMPACT_FACTOR * RECORD.itemsize)
+            self.assertEqual(len(CandidateStore(filename).load()), 2)
+
+    def test_snapshot(self):
+        """snapshots keep population of generations, store continues"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = CandidateStore(directory + "/population.store")
+            candidates = [Candidate().set_fitness(i, i, 1, 1)
+                          for i in range(3)]
+            store.add(candidates, 1)
+            store.snapshot(1)
+            store.remove(candidates[:1], 2)
+            store.snapshot(2)
+            store.add([Candidate().set_fitness(0, 0, 1, 1)], 3)
+            store.flush()
+            self.assertEqual(os.path.getsize(store.filename), RECORD.itemsize)
+
+            history = [np.load(name) for name in store.snapshots()]
+            self.assertEqual([len(h) for h in history], [3, 2])
+            self.assertEqual(list(history[1]['won_games']), [1, 2])
+            resumed = CandidateStore(store.filename)
+            self.assertEqual(len(resumed.load()), 3)
+            self.assertEqual(resumed.generation, 3)
+
+    def test_resume(self):
+        """population of stopped algorithm is loaded by new one"""
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                with GeneticAlgorithm(4, offsprings_num=2, fit_type="single",
+                                      parents_num_in_tournament=1,
+                                      games_number=1, snapshots=True,
+                                      tetrominos_in_single_game=5) as ga:
+                    ga._generate_population()
+                    ga._create_offsprings()
+                    ga.offsprings = ga._fit_all(ga.offsprings)
+                    ga._select_survivors()
+                    population = sorted(c.id for c in ga.population)
+
+                with GeneticAlgorithm(4, offsprings_num=2, fit_type="single",
+                                      parents_num_in_tournament=1,
+                                      games_number=1, snapshots=True,
+                                      tetrominos_in_single_game=5) as ga:
+                    ga._generate_population()
+                    self.assertEqual(sorted(c.id for c in ga.population),
+                                     population)
+            finally:
+                os.chdir(cwd)
+
+    def test_numpy_operators(self):
+        """array operators give the same results as candidates"""
+        candidates = [Candidate().set_fitness(w, l, 1, 1)
+                      for w, l in ((1, 5), (3, 0), (3, 2), (0, 0))]
+        parameters, won, lines = population_arrays(candidates)
+        order = fitness_order(won, lines)
+        self.assertEqual([candidates[i] for i in order],
+                         sorted(candidates, reverse=True))
+
+        rng = np.random.default_rng(3)
+        parents = tournament(rng, won, lines, 50, 4)
+        self.assertEqual(len(parents), 50)
+        self.assertIn(order[0], parents)
+        self.assertTrue(np.all(tournament(rng, won, lines, 5, 100)
+                               == order[0]))
+
+        a, b = np.array([0, 3, 1]), np.array([1, 3, 2])
+        children = normalize(crossover(parameters[a], parameters[b],
+                                       lines[a], lines[b]))
+        for child, i, j in zip(children, a, b):
+            expected = candidates[i].crossover(candidates[j]).parameters
+            np.testing.assert_allclose(child, expected)
+
+        mutated, mask = mutate(rng, parameters, 0.5, 0.2)
+        changed = np.abs(mutated - parameters)
+        self.assertTrue(np.all((changed > 0).sum(axis=1) == mask))
+        self.assertTrue(np.all(changed <= 0.2))
+
+        with GeneticAlgorithm(4, offsprings_num=2, fit_type="single",
+                              parents_num_in_tournament=2,
+                              games_number=1, load_files=False,
+                              tetrominos_in_single_game=5, seed=1,
+                              mutation_chance=1,
+                              numpy_operators=True) as ga:
+            ga.population = candidates
+            ga._create_offsprings()
+            ga._mutate_offsprings()
+            ga.offsprings = ga._fit_all(ga.offsprings)
+            ga._select_survivors()
+            self.assertEqual(len(ga.population), 4)
+            for c in ga.population:
+                self.assertAlmostEqual(np.linalg.norm(c.parameters), 1)
+
+    def test_steady_state(self):
+        """fitted offspring replace worst candidates until all games won"""
+        with self.assertRaises(ValueError):
+            GeneticAlgorithm(4, offsprings_num=2, fit_type="single",
+                             parents_num_in_tournament=1, load_files=False,
+                             steady_state=True)
+
+        with GeneticAlgorithm(4, offsprings_num=2, fit_type="multi",
+                              parents_num_in_tournament=1,
+                              games_number=2, load_files=False,
+                              tetrominos_in_single_game=5, seed=2,
+                              steady_state=True) as ga:
+            ga.population = [Candidate().set_fitness(0, 0, 2, 2)
+                             for _ in range(4)]
+            population = ga.population
+            parameters = ga._find_best_parameters_steady()
+
+            self.assertEqual(len(population), 4)
+            self.assertTrue(all(c.fitness.won_games == 2 for c in population))
+            self.assertIn(parameters, [c.parameters for c in population])
+            self.assertEqual(ga.generation, 2)
+            self.assertTrue(ga._fit_all([Candidate()])[0].fitness)
+
     def test_end_condition(self):
         """genetic algorithm end when all games are won"""
         with GeneticAlgorithm(10, offsprings_num=1,